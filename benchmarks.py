@@ -0,0 +1,242 @@
+"""Scale benchmarks for every pipeline stage on a synthetic corpus
+
+Each stage runs in a forked child so its peak RSS is measured on its own.
+Results are appended as JSON lines to experiments/benchmarks.jsonl and
+`--compare` flags stages that got slower than the previous run.
+
+    $ python benchmarks.py 1000,10000,100000 [--no-db] [--workdir /tmp/atd-bench]
+    $ python benchmarks.py --compare [tolerance]
+"""
+import csv
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from statistics import median
+from typing import Callable, Dict, List
+
+logging.basicConfig(
+    format="[%(levelname)s] %(asctime)s : %(message)s",
+    datefmt="%d/%m/%Y %I:%M:%S %p",
+    level="INFO",
+)
+logger = logging.getLogger()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(ROOT, "experiments", "benchmarks.jsonl")
+QUERIES = ("κυβέρνηση", "λογαριασμοί ΔΕΗ", "νοικοκυριά", "συνάντηση πρωθυπουργού", "Εκλογές ΚΙΝΑΛ")
+
+
+def _child(fn: Callable, args: tuple, out: mp.Queue) -> None:
+    start = time.perf_counter()
+    extra = fn(*args) or {}
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out.put((seconds, peak_kb / 1024, extra))
+
+
+# Run fn in a forked process, return (seconds, peak RSS in MB, extra metrics)
+def measure(fn: Callable, *args):
+    ctx = mp.get_context("fork")
+    out = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(fn, args, out))
+    proc.start()
+
+    # A child that raised never puts anything, so stop waiting once it's gone
+    result = None
+    while result is None:
+        try:
+            result = out.get(timeout=1)
+        except queue.Empty:
+            if not proc.is_alive():
+                try:
+                    result = out.get(timeout=1)
+                except queue.Empty:
+                    pass
+                break
+    proc.join()
+
+    if proc.exitcode or result is None:
+        raise RuntimeError(f"{fn.__name__} failed with exit code {proc.exitcode}")
+
+    return result
+
+
+def stage_generate(workdir: str, n_docs: int) -> None:
+    from utils.synth_corpus import write_corpus
+
+    write_corpus(workdir, n_docs)
+
+
+def stage_extract(workdir: str, n_docs: int) -> None:
+    from extract import Extractor
+
+    extractor = Extractor(os.path.join(workdir, "raw_html"), os.path.join(workdir, "links.csv"))
+    extractor.find_all_files()
+    extractor.construct_csv()
+
+    # Written next to the synthetic outfile.csv, whose crawl times the later stages load
+    extractor.csv_out.to_csv(
+        os.path.join(workdir, "extracted.csv"),
+        sep=",",
+        header=True,
+        encoding="utf-8",
+        index_label="id",
+        quoting=csv.QUOTE_NONE,
+    )
+
+
+def stage_write_article(workdir: str, n_docs: int) -> None:
+    from extract_body import read_df, write_article
+
+    logging.disable(logging.INFO)
+    df, _ = read_df(
+        os.path.join(workdir, "outfile.csv"), os.path.join(workdir, "articles"), override=True
+    )
+    write_article(df, os.path.join(workdir, "articles"))
+
+
+def stage_sql_load(workdir: str, n_docs: int, config: Dict) -> None:
+    from utils.get_local_link import get_paths
+
+    paths = get_paths(os.path.join(workdir, "articles"))
+    with open(os.path.join(workdir, "article_path.csv"), mode="w", encoding="utf-8") as out:
+        out.write("id,path\n")
+        out.writelines(f"{i},{p}\n" for i, p in enumerate(paths))
+
+    env = dict(os.environ, PGPASSWORD=config["password"])
+    subprocess.run(
+        [
+            "psql", "-q", "-v", "ON_ERROR_STOP=1",
+            "-h", config["host"], "-p", str(config["port"]),
+            "-U", config["user"], "-d", config["dbname"],
+            "-f", os.path.join(ROOT, "sql", "create-db.sql"),
+            "-v", f"CSV_PATH={os.path.join(workdir, 'outfile.csv')}",
+            "-v", f"LOCAL_PATH={os.path.join(workdir, 'article_path.csv')}",
+        ],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+
+def stage_query(workdir: str, n_docs: int, config: Dict) -> Dict:
+    from text_query import execute_similarity_query, initialize_conn, prep_query
+
+    logging.disable(logging.INFO)
+    latencies = []
+
+    with initialize_conn(config) as conn:
+        for _ in range(5):
+            for q in QUERIES:
+                query = prep_query(q, "title", "filepath")
+                start = time.perf_counter()
+                execute_similarity_query(query, conn, 100)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return dict(
+        p50_ms=round(median(latencies), 3),
+        p95_ms=round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, encoding="utf-8", check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes: List[int], workdir: str, use_db: bool = True) -> List[Dict]:
+    config = None
+    if use_db:
+        from text_query import read_from_config
+
+        config = read_from_config("postgre.ini")
+
+    stages = [
+        ("generate", stage_generate, ()),
+        ("extract", stage_extract, ()),
+        ("write_article", stage_write_article, ()),
+    ]
+    if config:
+        stages += [("sql_load", stage_sql_load, (config,)), ("query", stage_query, (config,))]
+
+    commit, stamp = git_commit(), datetime.isoformat(datetime.now(), sep=" ", timespec="seconds")
+    rows = []
+
+    for n_docs in sizes:
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.makedirs(workdir)
+
+        for name, fn, args in stages:
+            seconds, peak_mb, extra = measure(fn, workdir, n_docs, *args)
+            row = dict(
+                time=stamp,
+                commit=commit,
+                stage=name,
+                n_docs=n_docs,
+                seconds=round(seconds, 3),
+                docs_per_s=round(n_docs / seconds, 1) if seconds else None,
+                peak_rss_mb=round(peak_mb, 1),
+                **extra,
+            )
+            logger.info("%s", row)
+            rows.append(row)
+
+    with open(RESULTS, mode="a", encoding="utf-8") as out:
+        out.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    logger.info("Appended %d results to %s", len(rows), RESULTS)
+
+    return rows
+
+
+# Compare the two latest runs of every (stage, n_docs)
+def compare(tolerance: float = 0.2) -> bool:
+    history: Dict[tuple, List[Dict]] = {}
+    with open(RESULTS, mode="r", encoding="utf-8") as infile:
+        for line in infile:
+            row = json.loads(line)
+            history.setdefault((row["stage"], row["n_docs"]), []).append(row)
+
+    ok = True
+    for (stage, n_docs), rows in sorted(history.items()):
+        if len(rows) < 2:
+            continue
+        prev, last = rows[-2], rows[-1]
+        change = last["seconds"] / prev["seconds"] - 1 if prev["seconds"] else 0
+        level = logging.WARNING if change > tolerance else logging.INFO
+        logger.log(
+            level,
+            "%-14s %8d docs: %.3fs (%s) -> %.3fs (%s) %+.1f%%",
+            stage, n_docs, prev["seconds"], prev["commit"], last["seconds"], last["commit"], 100 * change,
+        )
+        ok &= change <= tolerance
+
+    return ok
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) > 1, (
+        "Not enough arguments: <n1,n2,...> [--no-db] [--workdir <dir>] | --compare [tolerance]"
+    )
+
+    if sys.argv[1] == "--compare":
+        sys.exit(0 if compare(float(sys.argv[2]) if len(sys.argv) > 2 else 0.2) else 1)
+
+    workdir = (
+        sys.argv[sys.argv.index("--workdir") + 1] if "--workdir" in sys.argv else "/tmp/atd-bench"
+    )
+    run([int(n) for n in sys.argv[1].split(",")], os.path.abspath(workdir), "--no-db" not in sys.argv)
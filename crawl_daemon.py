@@ -0,0 +1,199 @@
+"""Long running crawler that polls each site's listing page on its own schedule
+
+A site that shows new links is polled again sooner (interval halves, down to
+--min-interval), one that shows nothing new backs off (interval x1.5, up to
+--max-interval), so breaking news is picked up within minutes while quiet
+sites cost a request every half hour. Only unseen urls go into the
+fetch -> extract -> preprocess -> ingest stages of pipeline.py, which stay up
+for the whole run. A url only counts as seen once its page was fetched, so
+one that failed is tried again the next time it's listed, and ingest writes
+its batch after --flush-interval seconds at the latest so new articles are
+searchable within seconds of being fetched. Their lexemes are merged into the
+autocomplete lexicon of suggest.py every --lexicon-interval seconds and once
+more on shutdown.
+
+    $ python crawl_daemon.py --articles raw_articles --min-interval 60 --max-interval 1800
+"""
+import argparse
+import heapq
+import logging
+import random
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Set
+
+from pipeline import BASE_URLS, Article, Pipeline, add_stage_arguments, db_state, downstream_stages
+
+logger = logging.getLogger()
+
+
+class SeenUrls:
+    """Urls already fetched, plus the ones on their way through the fetch stage"""
+
+    def __init__(self, seen: Iterable[str] = ()):
+        self.seen: Set[str] = set(seen)
+        self.pending: Set[str] = set()
+        self.lock = threading.Lock()
+
+    # Links neither fetched nor in flight, which are now in flight
+    def claim(self, links: Iterable[str]) -> List[str]:
+        with self.lock:
+            new = [link for link in dict.fromkeys(links) if link not in self.seen and link not in self.pending]
+            self.pending.update(new)
+        return new
+
+    def done(self, url: str, fetched: bool) -> None:
+        with self.lock:
+            self.pending.discard(url)
+            if fetched:
+                self.seen.add(url)
+
+
+# Wraps the fetch stage so urls are marked seen only once they were fetched
+def track_fetched(factory: Callable[[], Callable], urls: SeenUrls) -> Callable[[], Callable]:
+    def wrapped():
+        handler = factory()
+
+        def handle(article: Article) -> List[Article]:
+            try:
+                outputs = handler(article)
+            except Exception:
+                urls.done(article.url, fetched=False)
+                raise
+            urls.done(article.url, fetched=True)
+            return outputs
+
+        if hasattr(handler, "close"):
+            handle.close = handler.close
+        return handle
+
+    return wrapped
+
+
+@dataclass(order=True)
+class SiteSchedule:
+    next_poll: float
+    url: str = field(compare=False)
+    interval: float = field(compare=False)
+    polls: int = field(default=0, compare=False)
+    new_links: int = field(default=0, compare=False)
+
+    # Speed up when something new showed up, back off otherwise
+    def adapt(self, n_new: int, lo: float, hi: float, jitter: float = 0.1) -> None:
+        self.polls += 1
+        self.new_links += n_new
+        self.interval = max(lo, self.interval / 2) if n_new else min(hi, self.interval * 1.5)
+        self.next_poll = time.monotonic() + self.interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def poll_forever(
+    seen: SeenUrls,
+    stop: threading.Event,
+    fetch_links: Callable[[str], List[str]],
+    min_interval: float = 60,
+    max_interval: float = 1800,
+) -> Iterator[Article]:
+    """Yield an Article for every url not seen before, until stop is set"""
+
+    schedule = [SiteSchedule(time.monotonic(), url, min_interval) for url in BASE_URLS]
+    heapq.heapify(schedule)
+
+    while not stop.is_set():
+        site = schedule[0]
+        if stop.wait(max(0.0, site.next_poll - time.monotonic())):
+            break
+
+        try:
+            links = fetch_links(site.url) or []
+        except Exception as e:
+            logger.warning("Polling %s failed: %s", site.url, e)
+            links = []
+
+        new = seen.claim(links)
+
+        site.adapt(len(new), min_interval, max_interval)
+        heapq.heapreplace(schedule, site)
+
+        logger.info(
+            "%s: %d new of %d links, next poll in %.0fs", site.url, len(new), len(links), site.interval
+        )
+
+        for link in new:
+            yield Article(link)
+
+    for site in schedule:
+        logger.info("%s: %d polls, %d new links", site.url, site.polls, site.new_links)
+
+
+# Merge newly ingested lexemes into the autocomplete lexicon until stop is set
+def refresh_lexicon(conf, stop: threading.Event, interval: float) -> None:
+    import psycopg
+
+    import suggest
+
+    while not stop.wait(interval):
+        try:
+            with psycopg.connect(**conf) as conn:
+                suggest.update(conn)
+        except Exception as e:
+            logger.warning("Updating the lexicon failed: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-interval", type=float, default=60, help="seconds")
+    parser.add_argument("--max-interval", type=float, default=1800, help="seconds")
+    parser.add_argument("--flush-interval", type=float, default=5, help="max seconds a fetched article waits for ingest")
+    parser.add_argument("--lexicon-interval", type=float, default=300, help="seconds between autocomplete updates")
+    add_stage_arguments(parser)
+    args = parser.parse_args()
+
+    from scraper import get_latest_from_url
+
+    next_id, seen, conf = 0, set(), None
+    if not args.dry_run:
+        from text_query import read_from_config
+
+        conf = read_from_config(args.config)
+        next_id, seen = db_state(conf)
+        logger.info("Starting at id %d, %d urls already stored", next_id, len(seen))
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    seen = SeenUrls(seen)
+    stages = downstream_stages(args, conf, next_id, flush_interval=args.flush_interval)
+    name, factory, workers = stages[0]
+    stages[0] = (name, track_fetched(factory, seen), workers)
+
+    refresher = None
+    if not args.dry_run:
+        refresher = threading.Thread(
+            target=refresh_lexicon, args=(conf, stop, args.lexicon_interval), name="lexicon", daemon=True
+        )
+        refresher.start()
+
+    pipeline = Pipeline(stages, queue_size=args.queue_size)
+    wall = pipeline.run(
+        poll_forever(seen, stop, get_latest_from_url, args.min_interval, args.max_interval)
+    )
+    pipeline.report(wall)
+
+    # Pick up what the last batches added
+    if refresher is not None:
+        stop.set()
+        refresher.join()
+
+        import psycopg
+
+        import suggest
+
+        with psycopg.connect(**conf) as conn:
+            suggest.update(conn)
+
+
+if __name__ == "__main__":
+    main()
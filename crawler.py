@@ -5,15 +5,21 @@ from typing import List
 
 import pandas as pd
 from requests import Response
-from requests_threads import AsyncSession
 from tqdm import tqdm
 
-session = AsyncSession(n=200)
+from utils.charset import append_encodings, sniff_encoding
+from utils.metrics import incr, timed
+from utils.rate_control import FailureLog, RateController, fetch_all
 
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
 
+# Urls that failed every attempt, next to the output directory like the encodings
+def failures_path(html_dir: str) -> str:
+    return os.path.abspath(html_dir).rstrip(os.sep) + "_failures.csv"
+
+
 class PoliticsCrawler:
     def __init__(self, links_path: str, output_dir: str) -> None:
         self.links = PoliticsCrawler.validate_file(links_path)
@@ -46,36 +52,57 @@ class PoliticsCrawler:
 
         self.df_links.set_axis(["url"], axis=1, inplace=True)
     
-    # Download HTML webpages and write to file
-    async def get_raw_html_and_write(self):
-        for link in tqdm(
-            self.df_links.url,
+    # Download HTML webpages and write to file, each site's concurrency adapts
+    # to its latency and 429/5xx/timeouts (see utils/rate_control.py)
+    @timed("crawler.get_raw_html_and_write")
+    def get_raw_html_and_write(self, max_attempts: int = 4):
+        urls = list(self.df_links.url)
+
+        with tqdm(
+            total=len(urls),
             desc="Downloading... ",
             mininterval=0.05,
             colour="blue",
             ascii=True,
             dynamic_ncols=True,
-        ):
-            self.responses.append(
-                await session.get(link, allow_redirects=False, timeout=5)
-            )  # add status check
+        ) as progress:
+
+            def done(i, res):
+                incr("crawler.pages")
+                progress.update()
 
-        await self.write_to_files(self.responses)
+            self.responses = fetch_all(
+                urls,
+                RateController(),
+                FailureLog(failures_path(self.outdir)),
+                max_attempts=max_attempts,
+                on_done=done,
+            )
+
+        self.write_to_files(self.responses)
 
         logger.info("Done fetching and writing to output directory")
 
-    async def write_to_files(self, responses: List[Response]):
+    @timed("crawler.write_to_files")
+    def write_to_files(self, responses: List[Response | None]):
 
         dir_to_write = os.path.join(os.path.curdir, self.outdir)
         start = self.check_empty_dir(self.outdir)
 
+        # Raw bytes as served, decoded once by the extractor with the
+        # encoding from the headers or the page's own <meta charset>.
+        # Links that failed (no 2xx after retries) leave an empty doc{i}.html so
+        # numbering stays aligned with links.csv
+        encodings = {}
         for idx, res in enumerate(responses):
-            with open(
-                file=f"{os.path.join(dir_to_write, f'doc{str(start + idx)}.html')}",
-                mode="w",
-                encoding="utf-8",
-            ) as out:
-                out.write(res.text)
+            fname = f"doc{str(start + idx)}.html"
+            content = res.content if res is not None else b""
+            with open(file=os.path.join(dir_to_write, fname), mode="wb") as out:
+                incr("crawler.bytes_written", out.write(content))
+            if res is not None:
+                encodings[fname] = sniff_encoding(content, res.headers.get("Content-Type"))
+
+        append_encodings(self.outdir, encodings)
 
     @staticmethod
     def validate_file(path) -> str:
@@ -126,8 +153,8 @@ def main():
 
     cr.read_from_file()
     
-    # Start async session and download all HTML pages
-    session.run(cr.get_raw_html_and_write)
+    # Download all HTML pages
+    cr.get_raw_html_and_write()
 
 
 if __name__ == "__main__":
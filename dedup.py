@@ -0,0 +1,268 @@
+"""Near duplicate detection with MinHash signatures and LSH banding
+
+The index is saved under the cache directory (see utils/lexicon.py) after
+every extract.py or pipeline.py run and loaded by the next one, so an
+article syndicated today is caught against yesterday's copy as well. Only
+the newest `max_docs` articles are kept: past that the oldest half is
+dropped, which bounds the index to about max_docs * (num_perm * 4 bytes +
+one bucket entry per band) and is plenty for copies of the same story
+that appear within days of each other.
+
+    $ python dedup.py csv_files/outfile.csv [threshold]
+"""
+import logging
+import os
+import re
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.lexicon import cache_path
+
+logger = logging.getLogger()
+
+LSH_FILE = "minhash.npz"
+
+WORD_RE = re.compile(r"\w+")
+MASK32 = np.uint64(0xFFFFFFFF)
+
+
+# Hash word n-grams of a text to 32 bit integers, none for texts under n words
+def shingles(text: str, n: int = 3) -> np.ndarray:
+    words = WORD_RE.findall(text.lower())
+    if len(words) < n:
+        return np.empty(0, dtype=np.uint64)
+
+    return np.unique(
+        np.fromiter(
+            (
+                zlib.crc32(" ".join(words[i : i + n]).encode("utf-8"))
+                for i in range(len(words) - n + 1)
+            ),
+            dtype=np.uint64,
+        )
+    )
+
+
+# Pick (bands, rows) so that the LSH S-curve crosses the threshold
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    best, best_err = (num_perm, 1), float("inf")
+
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        err = abs((1 / bands) ** (1 / rows) - threshold)
+        if err < best_err:
+            best, best_err = (bands, rows), err
+
+    return best
+
+
+class MinHashLSH:
+    """Incremental MinHash + LSH near-duplicate index
+
+    Signatures are kept as rows of a single uint32 array that grows by
+    doubling and each band bucket only remembers the representative doc
+    ids, so memory stays at num_perm * 4 bytes plus one entry per band
+    for every distinct article, for at most max_docs articles.
+    """
+
+    def __init__(
+        self, threshold: float = 0.8, num_perm: int = 64, seed: int = 1, max_docs: int = 100_000
+    ):
+        assert 0 < threshold <= 1, "Threshold must be in (0, 1]"
+
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing, one (a, b) pair per permutation
+        self.a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.seed = seed
+        self.max_docs = max_docs
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+
+        self.signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self.keys: List = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # None for texts too short to shingle, they'd all share one signature
+    def signature(self, text: str) -> np.ndarray | None:
+        hashed = shingles(text)
+        if not len(hashed):
+            return None
+        with np.errstate(over="ignore"):
+            values = (hashed[:, None] * self.a + self.b) >> np.uint64(32)
+        return (values & MASK32).min(axis=0).astype(np.uint32)
+
+    @staticmethod
+    def jaccard(sig1: np.ndarray, sig2: np.ndarray) -> float:
+        return float(np.count_nonzero(sig1 == sig2)) / len(sig1)
+
+    def band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [
+            sig[i * self.rows : (i + 1) * self.rows].tobytes() for i in range(self.bands)
+        ]
+
+    # Return the key of the best matching earlier doc above the threshold
+    def query(self, sig: np.ndarray) -> Optional[Tuple[object, float]]:
+        candidates = set()
+        for band, key in zip(self.buckets, self.band_keys(sig)):
+            candidates.update(band.get(key, ()))
+
+        best = None
+        for idx in candidates:
+            sim = self.jaccard(sig, self.signatures[idx])
+            if sim >= self.threshold and (best is None or sim > best[1]):
+                best = (self.keys[idx], sim)
+
+        return best
+
+    def insert(self, key, sig: np.ndarray) -> None:
+        if len(self.keys) >= self.max_docs:
+            self.compact(self.max_docs // 2)
+
+        idx = len(self.keys)
+        if idx == len(self.signatures):
+            self.signatures = np.resize(self.signatures, (2 * idx, self.num_perm))
+
+        self.signatures[idx] = sig
+        self.keys.append(key)
+
+        for band, bkey in zip(self.buckets, self.band_keys(sig)):
+            band.setdefault(bkey, []).append(idx)
+
+    # Forget all but the newest `keep` docs and rebuild the band buckets
+    def compact(self, keep: int) -> None:
+        n = len(self.keys)
+        keys, sigs = self.keys[n - keep :], self.signatures[n - keep : n].copy()
+
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = np.empty((max(1024, 2 * keep), self.num_perm), dtype=np.uint32)
+        self.keys = []
+        for key, sig in zip(keys, sigs):
+            self.insert(key, sig)
+
+        logger.info("Dropped the %d oldest of %d signatures", n - keep, n)
+
+    # Index a new doc unless it's a near duplicate of one already seen, a key
+    # seen before (the same url extracted again) doesn't match itself. Empty
+    # or very short texts are neither indexed nor matched
+    def add(self, key, text: str) -> Optional[Tuple[object, float]]:
+        sig = self.signature(text)
+        if sig is None:
+            return None
+
+        match = self.query(sig)
+
+        if match is not None and match[0] == key:
+            return None
+        if match is None:
+            self.insert(key, sig)
+
+        return match
+
+    # Keys are saved as strings, use urls rather than positions to persist
+    def save(self, path: str | None = None) -> None:
+        path = path or cache_path(LSH_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        n = len(self.keys)
+        with open(path + ".tmp", mode="wb") as out:
+            np.savez(
+                out,
+                signatures=self.signatures[:n],
+                keys=np.array([str(k) for k in self.keys], dtype=str),
+                num_perm=self.num_perm,
+                seed=self.seed,
+            )
+        os.replace(path + ".tmp", path)
+
+        logger.info("Saved %d signatures to %s", n, path)
+
+    # Buckets are rebuilt from the signatures, so threshold may differ from the
+    # saved index but num_perm and seed have to match
+    @staticmethod
+    def load(path: str | None = None, **kwargs) -> "MinHashLSH":
+        path = path or cache_path(LSH_FILE)
+        lsh = MinHashLSH(**kwargs)
+
+        try:
+            data = np.load(path)
+        except FileNotFoundError:
+            return lsh
+
+        if int(data["num_perm"]) != lsh.num_perm or int(data["seed"]) != lsh.seed:
+            logger.warning("Ignoring %s, it was built with other permutations", path)
+            return lsh
+
+        keys, sigs = data["keys"].tolist(), data["signatures"]
+        start = max(0, len(keys) - lsh.max_docs)
+        for key, sig in zip(keys[start:], sigs[start:]):
+            lsh.insert(key, sig)
+
+        logger.info("Loaded %d signatures from %s", len(lsh), path)
+
+        return lsh
+
+
+# Map every duplicate position to the key of the article it repeats, keys
+# default to positions and lsh to a new index
+def find_duplicates(
+    bodies: List[str],
+    threshold: float = 0.8,
+    num_perm: int = 64,
+    keys: List | None = None,
+    lsh: MinHashLSH | None = None,
+) -> Dict[int, object]:
+
+    if lsh is None:
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    keys = keys if keys is not None else range(len(bodies))
+    duplicates = {}
+
+    for i, (key, body) in enumerate(zip(keys, bodies)):
+        match = lsh.add(key, body)
+        if match is not None:
+            duplicates[i] = match[0]
+            logger.info(
+                "Document %s is a near duplicate of %s (similarity %.2f)", key, *match
+            )
+
+    logger.info(
+        "Found %d near duplicates in %d documents (threshold %.2f, %d bands x %d rows)",
+        len(duplicates),
+        len(bodies),
+        lsh.threshold,
+        lsh.bands,
+        lsh.rows,
+    )
+
+    return duplicates
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    logging.basicConfig(
+        format="[%(levelname)s] %(asctime)s %(message)s", datefmt="%d/%m/%Y %I:%M:%S %p"
+    )
+    logger.setLevel("INFO")
+
+    assert len(sys.argv) > 1, "Not enough arguments: <outfile.csv> [threshold]"
+
+    df = pd.read_csv(sys.argv[1], sep=",", encoding="utf-8", index_col=0)
+    dups = find_duplicates(
+        df.body.fillna("").tolist(),
+        threshold=float(sys.argv[2]) if len(sys.argv) > 2 else 0.8,
+    )
+
+    for dup, orig in dups.items():
+        print(f"{df.index[dup]} -> {df.index[orig]}")
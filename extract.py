@@ -12,13 +12,10 @@ import pandas as pd
 from bs4 import BeautifulSoup
 
 from crawler import PoliticsCrawler as crawler
-
-VALID_SITES = (
-    "https://www.in.gr",
-    "https://www.zougla.gr",
-    "https://www.naftemporiki.gr",
-    "https://www.news247.gr",
-)
+from dedup import MinHashLSH, find_duplicates
+from utils.charset import decode, read_encodings
+from utils.metrics import incr, span, timed
+from utils.sites import VALID_SITES
 
 
 class DirectoryNotFound(FileNotFoundError):
@@ -41,33 +38,47 @@ class Extractor:
         self.titles = []
         self.bodies = []
         self.csv_out: pd.DataFrame = None
+        self.duplicates = {}
+        self.encodings = read_encodings(self.dirname)
 
     def __repr__(self) -> str:
         return f"Reading from {self.dirname}"
     
+    # Empty files are links the crawler never got a response for
     def find_all_files(self):
 
         self.html_raw = sorted(
-            glob.glob(f"{self.dirname}/*.html", recursive=False),
-            key=lambda x: int("".join(filter(str.isdigit, x))),
+            (f for f in glob.glob(f"{self.dirname}/*.html", recursive=False) if os.path.getsize(f)),
+            key=Extractor.doc_number,
         )
 
+    @staticmethod
+    def doc_number(html_doc: str) -> int:
+        return int("".join(filter(str.isdigit, os.path.basename(html_doc))))
+
+    # doc{i}.html was downloaded from row i of the links file
+    @timed("extract.map_to_links")
     def map_to_links(self, simple=True):
 
         urls = crawler.get_all_links(self.links)
         urls = [re.split(r"\b(?:(/)(?!\1))+\b", s)[0] for s in urls] if simple else urls
 
-        return dict(zip(self.html_raw, urls))
+        return {doc: urls[Extractor.doc_number(doc)] for doc in self.html_raw}
+
+    # Encoding recorded by the crawler, None for pages saved before it did
+    def encoding_of(self, html_doc: str) -> str | None:
+        return self.encodings.get(os.path.basename(html_doc))
 
     # Get the right selector to match site
     def get_selector(self, doc):
+        return Extractor.selector_for_site(self.map_to_links()[doc])
 
-        map_ = self.map_to_links()
-        selector = None
+    @staticmethod
+    def selector_for_site(site: str):
 
-        if map_[doc] in VALID_SITES:
-            site = map_[doc]
+        selector = None
 
+        if site in VALID_SITES:
             if site == VALID_SITES[0]:
                 selector = Selector.IN
             elif site == VALID_SITES[1]:
@@ -80,11 +91,18 @@ class Extractor:
         return selector if selector is not None else None
 
     @staticmethod
-    def get_soup(html_doc: str, parser="html.parser") -> BeautifulSoup:
-        with open(html_doc, "r", encoding="utf-8") as infile:
+    @timed("extract.get_soup")
+    def get_soup(html_doc: str, parser="html.parser", encoding: str | None = None) -> BeautifulSoup:
+        with span("extract.read"), open(html_doc, "rb") as infile:
             raw = infile.read()
 
-        soup = BeautifulSoup(raw, parser)
+        # Single decode with the recorded encoding, pages saved before the
+        # crawler recorded one were written as utf-8
+        with span("extract.decode"):
+            text = decode(raw, encoding)
+
+        with span("extract.parse"):
+            soup = BeautifulSoup(text, parser)
 
         if soup:
             return soup
@@ -92,10 +110,15 @@ class Extractor:
             raise ParseError("Cannot parse documents.")
 
     # Extract the main article body per site
+    @timed("extract.extract_main")
     def extract_main(self, html_doc):
+        return Extractor.body_from_soup(
+            self.get_soup(html_doc, encoding=self.encoding_of(html_doc)),
+            self.get_selector(html_doc),
+        )
 
-        soup = self.get_soup(html_doc)
-        selector = self.get_selector(html_doc)
+    @staticmethod
+    def body_from_soup(soup: BeautifulSoup, selector) -> str:
 
         if isinstance(selector, list) and not (
             any(filter(lambda x: x.__len__() < 3, selector))
@@ -127,13 +150,20 @@ class Extractor:
             article_body_tags = soup.find(*selector).find_all("p", recursive=False)[:-1]
             article_body = "".join([t.text for t in article_body_tags])
 
-        clean_article_body = re.sub(r"[^\w .~;]+", "", article_body).strip()
+        with span("extract.clean"):
+            clean_article_body = re.sub(r"[^\w .~;]+", "", article_body).strip()
+        incr("extract.documents")
 
         return clean_article_body
 
+    @timed("extract.get_title")
     def get_title(self, html_doc, default="Empty"):
+        return Extractor.title_from_soup(
+            self.get_soup(html_doc, encoding=self.encoding_of(html_doc)), default
+        )
 
-        soup = self.get_soup(html_doc)
+    @staticmethod
+    def title_from_soup(soup: BeautifulSoup, default="Empty") -> str:
 
         title = soup.title.text
 
@@ -147,17 +177,42 @@ class Extractor:
 
     def get_all_titles(self):
         self.titles = [self.get_title(doc) for doc in self.html_raw if self.html_raw]
+
+    # Same as get_all_bodies and get_all_titles, parsing every page once
+    def get_all_bodies_and_titles(self):
+        sites = self.map_to_links()
+        self.bodies, self.titles = [], []
+
+        for doc in self.html_raw:
+            soup = self.get_soup(doc, encoding=self.encoding_of(doc))
+            self.bodies.append(Extractor.body_from_soup(soup, Extractor.selector_for_site(sites[doc])))
+            self.titles.append(Extractor.title_from_soup(soup))
     
-    # Create CSV file with body and metadata
-    def construct_csv(self):
+    # Create CSV file with body and metadata, near duplicates of this or an
+    # earlier run (the saved dedup.py index) are dropped unless dedup_threshold is 0
+    @timed("extract.construct_csv")
+    def construct_csv(self, dedup_threshold: float = 0.0):
         df_tmp = []
 
         map_ = self.map_to_links(simple=False)
 
-        self.get_all_bodies()
-        self.get_all_titles()
+        self.get_all_bodies_and_titles()
+
+        if dedup_threshold:
+            with span("extract.dedup"):
+                lsh = MinHashLSH.load(threshold=dedup_threshold)
+                self.duplicates = {
+                    self.html_raw[dup]: orig
+                    for dup, orig in find_duplicates(
+                        self.bodies, keys=[map_[doc] for doc in self.html_raw], lsh=lsh
+                    ).items()
+                }
+                lsh.save()
 
         for i, doc_path in enumerate(self.html_raw):
+            if doc_path in self.duplicates:
+                continue
+
             body = self.bodies[i]
             title = self.titles[i]
             now = datetime.isoformat(datetime.now(), sep=" ", timespec="seconds")
@@ -197,13 +252,15 @@ def main():
     logger.info("Starting the extractor...")
 
     assert (
-        len(sys.argv) == 4
-    ), "Not enough arguments: <html dir> <links.csv> <outfile.csv>"
+        len(sys.argv) in (4, 5)
+    ), "Not enough arguments: <html dir> <links.csv> <outfile.csv> [dedup threshold]"
 
     extractor = Extractor(sys.argv[1], sys.argv[2])
 
     extractor.find_all_files()
-    extractor.construct_csv()
+    extractor.construct_csv(
+        dedup_threshold=float(sys.argv[4]) if len(sys.argv) == 5 else 0.0
+    )
 
     # Write csv to outfile
     try:
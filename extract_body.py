@@ -2,7 +2,6 @@ import logging
 import os
 import re
 import sys
-import unicodedata
 from pathlib import Path
 from textwrap import fill
 from types import NoneType
@@ -11,6 +10,8 @@ from typing import Tuple
 import pandas as pd
 
 from extract import DirectoryNotFound
+from utils.lexicon import strip_accents_and_lowercase
+from utils.metrics import incr, span, timed
 
 logging.basicConfig(
     format="[%(levelname)s] %(asctime)s : %(message)s",
@@ -58,6 +59,7 @@ def check_sync(dirname: str, outfile: str):
     return ndir if diff else 0
 
 
+@timed("extract_body.read_df")
 def read_df(
     path: str, dirpath: str, override: bool = False
 ) -> Tuple[pd.DataFrame, int] | NoneType:
@@ -105,14 +107,17 @@ def read_df(
         logger.error(o.strerror)
 
 
-# Remove accents and lowercase each token
-def strip_accents_and_lowercase(s: str) -> str:
-    return "".join(
-        c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn"
-    ).lower()
+# Drop overly long tokens, strip accents and wrap lines for grep
+def preprocess(body: str, discard_longer: int = 20) -> str:
+    return fill(
+        strip_accents_and_lowercase(re.sub(r"\b\w{%d,}\b" % discard_longer, "", body)),
+        width=80,
+        break_long_words=False,
+    )
 
 
 # Write article body after preprocessing to a new file
+@timed("extract_body.write_article")
 def write_article(df: pd.DataFrame, outdir: str, discard_longer: int = 20) -> None:
     if not os.path.isdir(outdir):
         logger.warning("%s not a directory", outdir)
@@ -124,14 +129,13 @@ def write_article(df: pd.DataFrame, outdir: str, discard_longer: int = 20) -> No
 
     for i, txt in df.iterrows():
         fname = f"article{i}.txt"
-        with open(os.path.join(outdir, fname), mode="w", encoding="utf-8") as out:
-            res = out.write(
-                fill(
-                    strip_accents_and_lowercase(re.sub(r"\b\w{%d,}\b" % discard_longer, "", "".join(txt.values))),
-                    width=80,
-                    break_long_words=False,
-                )
-            )
+        with span("extract_body.preprocess"):
+            text = preprocess("".join(txt.values), discard_longer)
+        with span("extract_body.write"), open(
+            os.path.join(outdir, fname), mode="w", encoding="utf-8"
+        ) as out:
+            res = out.write(text)
+            incr("extract_body.bytes_written", res)
             if res:
                 logger.info("Wrote %s succesfully", fname)
             else:
@@ -0,0 +1,198 @@
+"""Typo and accent tolerant query terms against the corpus vocabulary
+
+The vocabulary is every word of the article bodies in outfile.csv, folded
+with the same strip_accents_and_lowercase as extract_body.py. A query word
+the vocabulary has in exactly that spelling is left alone. Otherwise its
+folded form maps to the most frequent surface form, so a query typed
+without tonos is restored to the accented form Postgres indexed, and a
+misspelled one is matched through the edits of the word itself (deletes,
+transpositions, replacements and inserts over the corpus alphabet).
+
+The vocabulary is an indexed SQLite file under the cache directory, so a
+search only looks up the handful of forms it needs instead of loading the
+whole vocabulary into every text_query.py process.
+
+    $ python fuzzy.py build csv_files/outfile.csv
+    $ python fuzzy.py correct "εκλογες κιναλ"
+"""
+import logging
+import os
+import re
+import sqlite3
+import sys
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+from utils.lexicon import cache_path, strip_accents_and_lowercase
+
+logger = logging.getLogger()
+
+VOCABULARY_FILE = "vocabulary.sqlite3"
+WORD_RE = re.compile(r"\w+")
+SCHEMA = """
+CREATE TABLE surfaces (surface TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE words (folded TEXT PRIMARY KEY, surface TEXT NOT NULL, n INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+"""
+# Stays under SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+MAX_PARAMS = 900
+
+
+def edits1(word: str, alphabet: str) -> Set[str]:
+    """Every string one delete, transposition, replacement or insert away"""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    return (
+        {a + b[1:] for a, b in splits if b}
+        | {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+        | {a + c + b[1:] for a, b in splits if b for c in alphabet}
+        | {a + c + b for a, b in splits for c in alphabet}
+    )
+
+
+class Speller:
+    def __init__(self, path: str | None = None, max_edit: int = 1):
+        self.path = path or cache_path(VOCABULARY_FILE)
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(self.path)
+
+        self.max_edit = max_edit
+        self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self.alphabet = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'alphabet'"
+        ).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM words").fetchone()[0]
+
+    @staticmethod
+    def build(surface_counts: Dict[str, int], path: str | None = None, min_count: int = 1) -> "Speller":
+        path = path or cache_path(VOCABULARY_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        surfaces: Counter = Counter()
+        for surface, n in surface_counts.items():
+            surfaces[surface.lower()] += n
+
+        # Most frequent surface form of every folded word
+        best: Dict[str, Tuple[str, int]] = {}
+        totals: Counter = Counter()
+        for surface, n in surfaces.items():
+            folded = strip_accents_and_lowercase(surface)
+            totals[folded] += n
+            if folded not in best or n > best[folded][1]:
+                best[folded] = (surface, n)
+
+        words = [
+            (folded, surface, totals[folded])
+            for folded, (surface, _) in best.items()
+            if totals[folded] >= min_count
+        ]
+        alphabet = "".join(sorted({c for folded, _, _ in words for c in folded}))
+
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        with sqlite3.connect(path + ".tmp") as conn:
+            conn.executescript(SCHEMA)
+            conn.executemany("INSERT INTO surfaces VALUES (?, ?)", surfaces.items())
+            conn.executemany("INSERT INTO words VALUES (?, ?, ?)", words)
+            conn.execute("INSERT INTO meta VALUES ('alphabet', ?)", (alphabet,))
+        conn.close()
+        os.replace(path + ".tmp", path)
+
+        logger.info("Saved %d words (%d surface forms) to %s", len(words), len(surfaces), path)
+
+        return Speller(path)
+
+    def known(self, folded: Iterable[str]) -> List[Tuple[str, str, int]]:
+        """(folded, surface, count) of the folded forms in the vocabulary"""
+        folded = list(folded)
+        rows = []
+        for i in range(0, len(folded), MAX_PARAMS):
+            chunk = folded[i : i + MAX_PARAMS]
+            rows += self.connection.execute(
+                f"SELECT folded, surface, n FROM words WHERE folded IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+        return rows
+
+    def lookup(self, word: str) -> Tuple[str, int] | None:
+        """(surface form, edit distance) of the best match for word"""
+        if self.connection.execute(
+            "SELECT 1 FROM surfaces WHERE surface = ?", (word.lower(),)
+        ).fetchone():
+            return word.lower(), 0
+
+        folded = strip_accents_and_lowercase(word)
+        if hit := self.known([folded]):
+            return hit[0][1], 0
+
+        # Short words have too many neighbours to be corrected reliably
+        if len(folded) <= self.max_edit + 2:
+            return None
+
+        frontier = {folded}
+        for dist in range(1, self.max_edit + 1):
+            frontier = {e for w in frontier for e in edits1(w, self.alphabet)}
+            if hits := self.known(frontier):
+                return max(hits, key=lambda row: (row[2], row[0]))[1], dist
+
+        return None
+
+    # Replace each misspelled or unaccented term, keeping known and unknown
+    # spellings and `keep` as they are
+    def correct(self, text: str, keep: Iterable[str] = ()) -> Tuple[str, Dict[str, str]]:
+        changes = {}
+
+        def fix(m: re.Match) -> str:
+            word = m.group(0)
+            if word in keep:
+                return word
+            hit = self.lookup(word)
+            if hit is None or hit[0] == word.lower():
+                return word
+            changes[word] = hit[0]
+            return hit[0]
+
+        return WORD_RE.sub(fix, text), changes
+
+
+# Opened once per process, and again only after the vocabulary is rebuilt
+def cached(path: str | None = None) -> Speller:
+    path = path or cache_path(VOCABULARY_FILE)
+    return _load(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _load(path: str, mtime: int) -> Speller:
+    return Speller(path)
+
+
+# Word counts of every article body in outfile.csv
+def vocabulary_from_csv(path: str) -> Dict[str, int]:
+    import pandas as pd
+
+    counts = Counter()
+    for body in pd.read_csv(path, sep=",", encoding="utf-8", usecols=("body",)).body.dropna():
+        counts.update(w.lower() for w in WORD_RE.findall(body) if not w.isdigit())
+
+    return counts
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        format="[%(levelname)-7s] %(asctime)s: %(message)s",
+        datefmt="%d/%m/%Y %H:%M:%S",
+        level=logging.INFO,
+    )
+
+    assert len(sys.argv) > 2, "Not enough arguments: build <outfile.csv> | correct <query>"
+
+    if sys.argv[1] == "build":
+        Speller.build(vocabulary_from_csv(sys.argv[2]))
+    else:
+        corrected, changes = Speller().correct(sys.argv[2])
+        for old, new in changes.items():
+            logger.info("%s -> %s", old, new)
+        print(corrected)
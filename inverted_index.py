@@ -0,0 +1,593 @@
+"""Compressed inverted index over the preprocessed article{i}.txt files
+
+ts_rank_cd has to detoast and score the tsvector of every matching row, so a
+query on a common term costs as much as the term is common. This index keeps
+postings sorted by doc id in blocks of BLOCK_SIZE: doc id deltas and term
+frequencies are varint coded, and every block records its last doc id, byte
+offset and the highest BM25 score any of its postings can reach. Top-k
+queries run MaxScore over the memory-mapped postings file: terms whose
+summed maxima can't beat the current k-th best score stop producing
+candidates, and whole blocks are skipped without being decoded when their
+block maxima can't beat it either.
+
+Terms are accent-folded words without stopwords, stemmed with greek_stemmer
+(utils.lexicon.stem). Ranking is disjunctive BM25, documents containing more
+of the query terms simply score higher. The index keeps no positions, so
+phrases, NEAR/N and OR only contribute their words to the ranking, while
+excluded words (NOT or -word next to the other terms) drop every document
+that contains them.
+
+    $ python inverted_index.py build raw_articles [csv_files/outfile.csv] [index_dir]
+    $ python inverted_index.py search "Εκλογές ΚΙΝΑΛ" [k] [index_dir]
+    $ python inverted_index.py bench [index_dir] [rounds]
+    $ python text_query.py "Εκλογές ΚΙΝΑΛ" no_doc_length 10 --backend index
+"""
+import csv
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+from statistics import median
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from query_parser import Node, parse, positive_terms
+from utils.lexicon import is_stopword, stem, strip_accents_and_lowercase
+from utils.sites import site_host
+
+logger = logging.getLogger()
+
+DEFAULT_INDEX_DIR = "inverted_index"
+POSTINGS_FILE = "postings.bin"
+BLOCKS_FILE = "blocks.bin"
+LEXICON_FILE = "lexicon.tsv"
+DOCS_FILE = "docs.tsv"
+META_FILE = "meta.json"
+
+BLOCK_SIZE = 128
+# last doc id, byte offset in postings.bin, no. of postings, max BM25 score
+BLOCK = struct.Struct("<IQHf")
+WORD_RE = re.compile(r"\w+")
+END = sys.maxsize
+
+
+def encode_varint(n: int, out: bytearray) -> None:
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varints(buf: bytes, count: int, pos: int = 0) -> Tuple[List[int], int]:
+    values = []
+    for _ in range(count):
+        n = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(n)
+
+    return values, pos
+
+
+# (surface, term) for every indexable word, greek_stemmer works on uppercase words.
+# Only query terms go into the persistent stems cache (see utils.lexicon.stem)
+def tokens(text: str, persist: bool = True) -> Iterator[Tuple[str, str]]:
+    for word in WORD_RE.findall(strip_accents_and_lowercase(text)):
+        if not word.isdigit() and not is_stopword(word):
+            yield word, stem(word.upper(), persist=persist)
+
+
+# Words a query excludes, only NOT words (or ORed words) ANDed with the rest
+# can be checked without positions
+def excluded_words(node: Node | None) -> List[str]:
+    if node is None or node[0] in ("term", "phrase"):
+        return []
+    if node[0] == "not":
+        raise ValueError("NOT needs something to exclude from")
+
+    excluded = []
+    for child in node[1] if node[0] in ("and", "or") else node[1:3]:
+        if node[0] == "and" and child[0] == "not":
+            words = child[1]
+            if words[0] == "or" and all(n[0] == "term" for n in words[1]):
+                excluded += [n[1] for n in words[1]]
+            elif words[0] == "term":
+                excluded.append(words[1])
+            else:
+                raise ValueError("The index backend can only exclude words, not phrases or groups")
+        elif node[0] == "and" and child[0] == "and":
+            excluded += excluded_words(child)
+        elif child[0] == "not" or excluded_words(child):
+            raise ValueError("The index backend only supports NOT next to the other terms")
+
+    return excluded
+
+
+def bm25(tf: int, length: int, idf: float, avgdl: float, k1: float, b: float) -> float:
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
+
+
+# Yield (doc id, path) of every article{i}.txt in a directory, by id
+def article_files(dirname: str) -> Iterator[Tuple[int, str]]:
+    assert os.path.isdir(dirname), f"No such directory {dirname}"
+
+    for fname in sorted(
+        (f for f in os.listdir(dirname) if f.startswith("article") and f.endswith(".txt")),
+        key=lambda x: int("".join(filter(str.isdigit, x))),
+    ):
+        yield int("".join(filter(str.isdigit, fname))), os.path.abspath(os.path.join(dirname, fname))
+
+
+# id -> (title, url, wall_time) from outfile.csv
+def read_metadata(outfile: str) -> Dict[int, Tuple[str, str, str]]:
+    csv.field_size_limit(sys.maxsize)
+
+    with open(outfile, mode="r", encoding="utf-8") as infile:
+        reader = csv.reader(infile)
+        next(reader)
+        return {int(row[0]): (row[1], row[5], row[6]) for row in reader}
+
+
+def build(
+    articles_dir: str,
+    outdir: str = DEFAULT_INDEX_DIR,
+    outfile: str | None = None,
+    k1: float = 1.2,
+    b: float = 0.75,
+) -> None:
+    metadata = read_metadata(outfile) if outfile else {}
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    surfaces: Dict[str, Counter] = defaultdict(Counter)
+    docs = []
+
+    start = time.perf_counter()
+    for doc_id, path in article_files(articles_dir):
+        with open(path, mode="r", encoding="utf-8") as infile:
+            words = list(tokens(infile.read(), persist=False))
+
+        for surface, term in words:
+            surfaces[term][surface] += 1
+        for term, tf in Counter(term for _, term in words).items():
+            postings[term].append((doc_id, tf))
+
+        title, url, wall_time = metadata.get(doc_id, ("", "", ""))
+        docs.append((doc_id, len(words), path, title, url, wall_time))
+
+    n_docs = len(docs)
+    avgdl = sum(d[1] for d in docs) / max(n_docs, 1)
+    lengths = {d[0]: d[1] for d in docs}
+    logger.info("Tokenized %d documents in %.2fs", n_docs, time.perf_counter() - start)
+
+    os.makedirs(outdir, exist_ok=True)
+    n_blocks = n_bytes = 0
+
+    with open(os.path.join(outdir, POSTINGS_FILE), mode="wb") as post, open(
+        os.path.join(outdir, BLOCKS_FILE), mode="wb"
+    ) as blocks, open(os.path.join(outdir, LEXICON_FILE), mode="w", encoding="utf-8") as lex:
+
+        for term in sorted(postings):
+            plist = postings[term]
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            first_block, term_max, prev = n_blocks, 0.0, 0
+
+            for i in range(0, len(plist), BLOCK_SIZE):
+                block = plist[i : i + BLOCK_SIZE]
+                buf = bytearray()
+                for doc_id, _ in block:
+                    encode_varint(doc_id - prev, buf)
+                    prev = doc_id
+                for _, tf in block:
+                    encode_varint(tf, buf)
+
+                # Rounded up so the float32 bound never falls below a real score
+                block_max = max(bm25(tf, lengths[d], idf, avgdl, k1, b) for d, tf in block) * (1 + 1e-5)
+                term_max = max(term_max, block_max)
+
+                blocks.write(BLOCK.pack(block[-1][0], n_bytes, len(block), block_max))
+                post.write(buf)
+                n_bytes += len(buf)
+                n_blocks += 1
+
+            lex.write(
+                f"{term}\t{surfaces[term].most_common(1)[0][0]}\t{len(plist)}\t{idf:.6f}\t"
+                f"{first_block}\t{n_blocks - first_block}\t{term_max:.6f}\n"
+            )
+
+    with open(os.path.join(outdir, DOCS_FILE), mode="w", encoding="utf-8", newline="") as out:
+        csv.writer(out, delimiter="\t").writerows(docs)
+
+    with open(os.path.join(outdir, META_FILE), mode="w", encoding="utf-8") as out:
+        json.dump(dict(n_docs=n_docs, avgdl=avgdl, k1=k1, b=b, block_size=BLOCK_SIZE), out)
+
+    logger.info(
+        "Wrote %d terms, %d blocks, %.1f MB of postings to %s in %.2fs",
+        len(postings), n_blocks, n_bytes / 2**20, outdir, time.perf_counter() - start,
+    )
+
+
+class Term(NamedTuple):
+    surface: str
+    df: int
+    idf: float
+    first_block: int
+    n_blocks: int
+    max_score: float
+
+
+class PostingCursor:
+    """Position in one term's postings, blocks are decoded only when entered"""
+
+    def __init__(self, index: "InvertedIndex", term: Term):
+        self.index = index
+        self.term = term
+        self.max_score = term.max_score
+        self.blocks = [
+            BLOCK.unpack_from(index.blocks, (term.first_block + i) * BLOCK.size)
+            for i in range(term.n_blocks)
+        ]
+        self.block = -1
+        self.docs: List[int] = []
+        self.tfs: List[int] = []
+        self.pos = 0
+        self.doc = -1
+
+    def _enter(self, block: int) -> None:
+        last_doc, offset, count, _ = self.blocks[block]
+        base = self.blocks[block - 1][0] if block else 0
+        deltas, pos = decode_varints(self.index.postings, count, offset)
+        self.tfs, _ = decode_varints(self.index.postings, count, pos)
+
+        self.docs = []
+        for delta in deltas:
+            base += delta
+            self.docs.append(base)
+
+        self.block, self.pos = block, 0
+        self.index.stats["blocks_decoded"] += 1
+
+    # Block that would hold target, without decoding anything
+    def _find_block(self, target: int) -> int:
+        block = max(self.block, 0)
+        while block < len(self.blocks) and self.blocks[block][0] < target:
+            block += 1
+        return block
+
+    def next_geq(self, target: int) -> None:
+        if target <= self.doc:
+            return
+
+        block = self._find_block(target)
+        if block == len(self.blocks):
+            self.doc = END
+            return
+
+        if block != self.block:
+            self._enter(block)
+        self.pos = bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+
+    def block_max(self, target: int) -> float:
+        block = self._find_block(target)
+        return self.blocks[block][3] if block < len(self.blocks) else 0.0
+
+    def block_last(self, target: int) -> int:
+        block = self._find_block(target)
+        return self.blocks[block][0] if block < len(self.blocks) else END
+
+    def score(self) -> float:
+        meta = self.index.meta
+        return bm25(
+            self.tfs[self.pos], self.index.lengths[self.doc], self.term.idf,
+            meta["avgdl"], meta["k1"], meta["b"],
+        )
+
+
+class InvertedIndex:
+    connection = None
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, META_FILE), mode="r", encoding="utf-8") as infile:
+            self.meta = json.load(infile)
+
+        self.terms: Dict[str, Term] = {}
+        with open(os.path.join(index_dir, LEXICON_FILE), mode="r", encoding="utf-8") as infile:
+            for line in infile:
+                term, surface, df, idf, first, n, max_score = line.rstrip("\n").split("\t")
+                self.terms[term] = Term(surface, int(df), float(idf), int(first), int(n), float(max_score))
+
+        self.lengths: Dict[int, int] = {}
+        self.docs: Dict[int, Tuple[str, str, str, str]] = {}
+        with open(os.path.join(index_dir, DOCS_FILE), mode="r", encoding="utf-8", newline="") as infile:
+            for doc_id, length, path, title, url, wall_time in csv.reader(infile, delimiter="\t"):
+                self.lengths[int(doc_id)] = int(length)
+                self.docs[int(doc_id)] = (path, title, url, wall_time)
+
+        self._files = [open(os.path.join(index_dir, f), mode="rb") for f in (POSTINGS_FILE, BLOCKS_FILE)]
+        self.postings, self.blocks = (
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+            for f in self._files
+        )
+        self.stats = Counter()
+
+        logger.info("Loaded %d terms and %d documents from %s", len(self.terms), len(self.lengths), index_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for m in (self.postings, self.blocks):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    # One cursor per known term of the words, phrases and NEAR are reduced to their words
+    def cursors(self, words: List[str]) -> List[PostingCursor]:
+        terms = {term for _, term in tokens(" ".join(words))}
+        return [PostingCursor(self, self.terms[t]) for t in terms if t in self.terms]
+
+    # Ids of the documents containing any of the words
+    def containing(self, words: List[str]) -> set:
+        docs = set()
+        for c in self.cursors(words):
+            c.next_geq(0)
+            while c.doc != END:
+                docs.add(c.doc)
+                c.next_geq(c.doc + 1)
+        return docs
+
+    # Cursors of the words to rank by and accept with the excluded documents removed
+    def plan(self, user_input: str, accept=None):
+        node = parse(user_input)
+        if node is not None and not positive_terms(node):
+            raise ValueError(f"Query [{user_input}] only excludes terms")
+
+        excluded = self.containing(excluded_words(node))
+        if not excluded:
+            return self.cursors(positive_terms(node)), accept
+
+        def accept_included(doc: int) -> bool:
+            return doc not in excluded and (accept is None or accept(doc))
+
+        return self.cursors(positive_terms(node)), accept_included
+
+    def top_k(self, user_input: str, k: int = 10, accept=None) -> List[Tuple[float, int]]:
+        """(score, doc id) of the k best BM25 matches with block-max MaxScore
+
+        Terms are ordered by their highest score. Once the k-th best score
+        beats the summed maxima of the weakest terms, those terms can't make
+        a document on their own: candidates come only from the other
+        (essential) terms and the weak ones are probed with skips. Runs of
+        essential blocks whose maxima can't reach the threshold are jumped
+        over without being decoded.
+
+        Args:
+            user_input (str): keywords
+            k (int): no. of results
+            accept (Callable[[int], bool]): optional filter on doc ids
+        """
+        cursors, accept = self.plan(user_input, accept)
+        cursors.sort(key=lambda c: c.max_score)
+        for c in cursors:
+            c.next_geq(0)
+
+        # upper[i]: best possible score from cursors[: i + 1]
+        upper, total = [], 0.0
+        for c in cursors:
+            total += c.max_score
+            upper.append(total)
+
+        heap: List[Tuple[float, int]] = []
+        threshold, first = 0.0, 0
+
+        while first < len(cursors):
+            essential = cursors[first:]
+            doc = min(c.doc for c in essential)
+            if doc == END:
+                break
+
+            bound = (upper[first - 1] if first else 0.0) + sum(c.block_max(doc) for c in essential)
+            if len(heap) == k and bound <= threshold:
+                target = min(c.block_last(doc) for c in essential) + 1
+                for c in essential:
+                    c.next_geq(target)
+                self.stats["block_skips"] += 1
+                continue
+
+            score = 0.0
+            for c in essential:
+                if c.doc == doc:
+                    score += c.score()
+                    c.next_geq(doc + 1)
+
+            for i in range(first - 1, -1, -1):
+                if score + upper[i] <= threshold:
+                    break
+                cursors[i].next_geq(doc)
+                if cursors[i].doc == doc:
+                    score += cursors[i].score()
+
+            self.stats["docs_scored"] += 1
+            if accept is not None and not accept(doc):
+                continue
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -doc))
+            else:
+                continue
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first < len(cursors) and upper[first] <= threshold:
+                    first += 1
+
+        return [(score, -neg) for score, neg in sorted(heap, reverse=True)]
+
+    # Score every posting of every term, for checking top_k and for comparison
+    def exhaustive(self, user_input: str, k: int = 10) -> List[Tuple[float, int]]:
+        scores: Dict[int, float] = defaultdict(float)
+        cursors, accept = self.plan(user_input)
+        for c in cursors:
+            c.next_geq(0)
+            while c.doc != END:
+                if accept is None or accept(c.doc):
+                    scores[c.doc] += c.score()
+                self.stats["docs_scored"] += 1
+                c.next_geq(c.doc + 1)
+
+        return heapq.nlargest(k, ((s, d) for d, s in scores.items()), key=lambda x: (x[0], -x[1]))
+
+    def search(
+        self, user_input: str, *columns: str, k: int = 10, metric: int = 0, **filters
+    ) -> List[NamedTuple]:
+        """Same rows as the SQL backends (see search_backend.py), metric is ignored"""
+        accept = self.filter(**filters)
+        fields = dict(id=0, filepath=1, title=2, doc_url=3, time_crawled=4)
+        if unknown := set(columns) - set(fields):
+            raise ValueError(f"Unknown columns {unknown}")
+
+        Row = namedtuple("Row", (*columns, "rank"))
+        rows = []
+        for score, doc_id in self.top_k(user_input, k, accept):
+            values = (doc_id, *self.docs[doc_id])
+            rows.append(Row(*(values[fields[c]] for c in columns), score))
+
+        return rows
+
+    def filter(self, site: str | None = None, since: str | None = None, until: str | None = None):
+        if not (site or since or until):
+            return None
+
+        host = site_host(site) if site else None
+
+        def accept(doc_id: int) -> bool:
+            _, _, url, wall_time = self.docs[doc_id]
+            if host and re.sub(r"^https?://(www\.)?", "", url).split("/")[0] != host:
+                return False
+            if since and wall_time < since:
+                return False
+            if until and wall_time >= until:
+                return False
+            return True
+
+        return accept
+
+
+# Common and rare terms through MaxScore, exhaustive scoring and (if reachable) the GIN index
+def benchmark(index_dir: str = DEFAULT_INDEX_DIR, rounds: int = 20, k: int = 10) -> List[Dict]:
+    index = InvertedIndex(index_dir)
+    by_df = sorted(index.terms.values(), key=lambda t: t.df, reverse=True)
+    rare = [t for t in by_df if 2 <= t.df <= 5]
+
+    workloads = {
+        "common": [t.surface for t in by_df[:5]],
+        "common_pair": [f"{a.surface} {b.surface}" for a, b in zip(by_df[:5], by_df[5:10])],
+        "rare": [t.surface for t in rare[:5]],
+        "mixed": [f"{a.surface} {b.surface}" for a, b in zip(by_df[:5], rare[:5])],
+    }
+
+    postgres = None
+    try:
+        from search_backend import open_backend
+
+        postgres = open_backend("postgres")
+    except Exception as e:
+        logger.warning("Skipping postgres: %s", e)
+
+    def timeit(fn, queries: List[str]) -> float:
+        latencies = []
+        for _ in range(rounds):
+            for q in queries:
+                t0 = time.perf_counter()
+                fn(q)
+                latencies.append((time.perf_counter() - t0) * 1000)
+        return round(median(latencies), 3)
+
+    report = []
+    logging.disable(logging.INFO)
+    for name, queries in workloads.items():
+        if not queries:
+            continue
+
+        index.stats.clear()
+        maxscore_ms = timeit(lambda q: index.top_k(q, k), queries)
+        maxscore = dict(index.stats)
+
+        index.stats.clear()
+        exhaustive_ms = timeit(lambda q: index.exhaustive(q, k), queries)
+        exhaustive = dict(index.stats)
+
+        row = dict(
+            workload=name,
+            maxscore_ms=maxscore_ms,
+            exhaustive_ms=exhaustive_ms,
+            maxscore_scored=maxscore.get("docs_scored", 0) // (rounds * len(queries)),
+            exhaustive_scored=exhaustive.get("docs_scored", 0) // (rounds * len(queries)),
+        )
+        if postgres is not None:
+            row["gin_ms"] = timeit(lambda q: postgres.search(q, "title", "filepath", k=k), queries)
+        report.append(row)
+    logging.disable(logging.NOTSET)
+
+    for row in report:
+        logger.info("%s", row)
+
+    if postgres is not None:
+        postgres.close()
+    index.close()
+
+    return report
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        format="[%(levelname)-7s] %(asctime)s: %(message)s",
+        datefmt="%d/%m/%Y %H:%M:%S",
+        level=logging.INFO,
+    )
+
+    assert len(sys.argv) > 1, (
+        "Not enough arguments: build <articles_dir> [outfile.csv] [index_dir] | "
+        "search <query> [k] [index_dir] | bench [index_dir] [rounds]"
+    )
+
+    mode = sys.argv[1]
+
+    if mode == "build":
+        build(
+            sys.argv[2],
+            sys.argv[4] if len(sys.argv) > 4 else DEFAULT_INDEX_DIR,
+            outfile=sys.argv[3] if len(sys.argv) > 3 else None,
+        )
+    elif mode == "search":
+        with InvertedIndex(sys.argv[4] if len(sys.argv) > 4 else DEFAULT_INDEX_DIR) as index:
+            for row in index.search(
+                sys.argv[2], "id", "title", k=int(sys.argv[3]) if len(sys.argv) > 3 else 10
+            ):
+                print(f"{row.id:>8} {row.rank:8.4f} {row.title}")
+            logger.info("%s", dict(index.stats))
+    elif mode == "bench":
+        benchmark(
+            sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_DIR,
+            rounds=int(sys.argv[3]) if len(sys.argv) > 3 else 20,
+        )
+    else:
+        raise ValueError(f"Unknown mode {mode}")
@@ -0,0 +1,588 @@
+"""Streaming pipeline: scrape -> fetch -> extract -> preprocess -> ingest
+
+Replaces running scraper.py, crawler.py, extract.py, extract_body.py,
+utils/get_local_link.py and create-db.sql by hand. Stages are linked with
+bounded queues so a full downstream stage blocks the ones before it, and a
+link becomes searchable in `documents` as soon as it reaches the last stage.
+
+Example:
+    $ python pipeline.py --articles raw_articles --fetch-workers 16
+    $ python pipeline.py --links csv_files/links.csv --dry-run
+"""
+import argparse
+import itertools
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterable, List
+
+import requests
+from bs4 import BeautifulSoup
+
+from dedup import MinHashLSH
+from extract import Extractor
+from extract_body import preprocess
+from utils.charset import decode, read_encodings, sniff_encoding
+from utils.metrics import enabled, record
+from utils.rate_control import FailureLog, RateController, fetch
+
+logging.basicConfig(
+    format="[%(levelname)s] %(asctime)s : %(message)s",
+    datefmt="%d/%m/%Y %I:%M:%S %p",
+    level="INFO",
+)
+logger = logging.getLogger()
+
+BASE_URLS = (
+    "https://www.in.gr/politics/",
+    "https://www.zougla.gr/politiki/main",
+    "https://www.naftemporiki.gr/politics",
+    "https://www.news247.gr/politiki/",
+)
+
+_DONE = object()
+
+
+@dataclass
+class Article:
+    url: str
+    html: str = ""
+    title: str = ""
+    body: str = ""
+    text: str = ""
+    id: int = -1
+    filepath: str = ""
+    html_path: str = ""
+    time_crawled: str = field(
+        default_factory=lambda: datetime.isoformat(datetime.now(), sep=" ", timespec="seconds")
+    )
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items_in: int = 0
+    items_out: int = 0
+    errors: int = 0
+    busy: float = 0.0
+    blocked_put: float = 0.0
+    starved: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **values) -> None:
+        with self.lock:
+            for key, value in values.items():
+                setattr(self, key, getattr(self, key) + value)
+
+
+class Stage:
+    """Pool of worker threads reading from `inbox` and writing to `outbox`
+
+    `factory` is called once per worker and returns the handler for one
+    item, so each worker can own a session or a DB connection. A handler
+    returns an iterable of outputs and may expose `close()` for flushing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Callable],
+        workers: int,
+        inbox: queue.Queue,
+        outbox: queue.Queue | None,
+    ):
+        self.name = name
+        self.factory = factory
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stats = StageStats(name, workers)
+        self.downstream_workers = 0
+        self._alive = workers
+        self._reading = workers
+        self._alive_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self.run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self) -> None:
+        for t in self.threads:
+            t.start()
+
+    def join(self) -> None:
+        for t in self.threads:
+            t.join()
+
+    def put(self, item) -> None:
+        start = time.perf_counter()
+        self.outbox.put(item)
+        self.stats.add(blocked_put=time.perf_counter() - start)
+
+    def get(self, timeout: float | None = None):
+        start = time.perf_counter()
+        try:
+            return self.inbox.get(timeout=timeout)
+        finally:
+            self.stats.add(starved=time.perf_counter() - start)
+
+    def run(self) -> None:
+        handler = None
+        try:
+            handler = self.factory()
+            self.serve(handler)
+        except Exception:
+            logger.exception("[%s] worker failed", self.name)
+            # With no worker left reading the inbox the stage before would
+            # block on it forever, so whatever is still coming is dropped
+            with self._alive_lock:
+                self._reading -= 1
+                last = self._reading == 0
+            if last:
+                self.drain()
+            raise
+        else:
+            with self._alive_lock:
+                self._reading -= 1
+        finally:
+            # A worker that failed, even in close(), still counts as finished,
+            # otherwise the next stage would wait forever for its _DONE
+            try:
+                if hasattr(handler, "close"):
+                    handler.close()
+            finally:
+                self.finish()
+
+    def serve(self, handler: Callable) -> None:
+        # Handlers with an `idle()` (e.g. ingest's flush) get it called whenever
+        # nothing arrives for `idle_timeout` seconds
+        idle = getattr(handler, "idle", None)
+        idle_timeout = getattr(handler, "idle_timeout", None) if idle else None
+
+        while True:
+            try:
+                item = self.get(idle_timeout)
+            except queue.Empty:
+                idle()
+                continue
+
+            if item is _DONE:
+                return
+
+            start = time.perf_counter()
+            try:
+                outputs = list(handler(item))
+            except Exception as e:
+                logger.warning("[%s] dropped %s: %s", self.name, getattr(item, "url", item), e)
+                self.stats.add(errors=1)
+                outputs = []
+            elapsed = time.perf_counter() - start
+            if enabled():
+                record(f"pipeline.{self.name}", elapsed)
+            self.stats.add(items_in=1, busy=elapsed)
+
+            if self.outbox is not None:
+                for out in outputs:
+                    self.put(out)
+            self.stats.add(items_out=len(outputs))
+
+    # Read and drop items until the stage before is done
+    def drain(self) -> None:
+        while self.inbox.get() is not _DONE:
+            self.stats.add(items_in=1, errors=1)
+
+    # The last worker to finish shuts down the next stage
+    def finish(self) -> None:
+        with self._alive_lock:
+            self._alive -= 1
+            last = self._alive == 0
+        if last and self.outbox is not None:
+            for _ in range(self.downstream_workers):
+                self.outbox.put(_DONE)
+
+
+def site_of(url: str) -> str:
+    return re.split(r"\b(?:(/)(?!\1))+\b", url)[0]
+
+
+# Stage handlers, one factory per stage
+def discover_handler(seen: set) -> Callable[[], Callable]:
+    from scraper import get_latest_from_url
+
+    seen_lock = threading.Lock()
+
+    def factory():
+        def handle(url: str) -> List[Article]:
+            new = []
+            for link in get_latest_from_url(url) or []:
+                with seen_lock:
+                    if link in seen:
+                        continue
+                    seen.add(link)
+                new.append(Article(link))
+            return new
+
+        return handle
+
+    return factory
+
+
+# Workers share one RateController, so each site gets as many of them at a
+# time as its latency and error rate allow
+def fetch_handler(
+    timeout: float = 5, max_attempts: int = 4, failures: str | None = None
+) -> Callable[[], Callable]:
+    controller = RateController(initial_timeout=timeout)
+    failure_log = FailureLog(failures) if failures else None
+
+    def factory():
+        ses = requests.session()
+
+        def handle(article: Article) -> List[Article]:
+            res = fetch(ses, article.url, controller, failure_log, max_attempts)
+            article.html = decode(res.content, sniff_encoding(res.content, res.headers.get("Content-Type")))
+            return [article]
+
+        handle.close = ses.close
+        return handle
+
+    return factory
+
+
+def local_fetch_handler(html_dir: str) -> Callable[[], Callable]:
+    encodings = read_encodings(html_dir)
+
+    def factory():
+        def handle(article: Article) -> List[Article]:
+            with open(os.path.join(html_dir, article.html_path), "rb") as infile:
+                article.html = decode(infile.read(), encodings.get(article.html_path))
+            return [article]
+
+        return handle
+
+    return factory
+
+
+# The dedup index is saved once the last extract worker is done
+def extract_handler(lsh: MinHashLSH | None, workers: int = 1) -> Callable[[], Callable]:
+    lsh_lock = threading.Lock()
+    open_workers = [workers]
+
+    def factory():
+        def handle(article: Article) -> List[Article]:
+            selector = Extractor.selector_for_site(site_of(article.url))
+            if selector is None:
+                raise ValueError("Unknown site")
+
+            soup = BeautifulSoup(article.html, "html.parser")
+            article.body = Extractor.body_from_soup(soup, selector)
+            article.title = Extractor.title_from_soup(soup)
+            article.html = ""
+
+            if lsh is not None:
+                with lsh_lock:
+                    match = lsh.add(article.url, article.body)
+                if match is not None:
+                    logger.info("Skipping %s, near duplicate of %s", article.url, match[0])
+                    return []
+
+            return [article]
+
+        def close():
+            with lsh_lock:
+                open_workers[0] -= 1
+                if open_workers[0] == 0 and lsh is not None:
+                    lsh.save()
+
+        handle.close = close
+        return handle
+
+    return factory
+
+
+def preprocess_handler(articles_dir: str | None, ids: Iterable[int]) -> Callable[[], Callable]:
+    id_lock = threading.Lock()
+
+    def factory():
+        def handle(article: Article) -> List[Article]:
+            with id_lock:
+                article.id = next(ids)
+
+            article.text = preprocess(article.body)
+
+            if articles_dir:
+                article.filepath = os.path.abspath(
+                    os.path.join(articles_dir, f"article{article.id}.txt")
+                )
+                with open(article.filepath, mode="w", encoding="utf-8") as out:
+                    out.write(article.text)
+
+            return [article]
+
+        return handle
+
+    return factory
+
+
+# Rows are written every batch_size articles, and with flush_interval also
+# once the oldest buffered one has waited that long or the inbox runs dry
+def ingest_handler(
+    conf: dict, batch_size: int = 50, flush_interval: float | None = None
+) -> Callable[[], Callable]:
+    import psycopg
+
+    insert = (
+        "INSERT INTO documents (id, title, filepath, length, size_kb, doc_url, time_crawled, docvec) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, to_tsvector('greek', %s))"
+    )
+
+    def factory():
+        conn = psycopg.connect(**conf)
+        batch = []
+        oldest = [0.0]
+
+        # Monthly partitions of create-db-partitioned.sql are created on demand
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT to_regprocedure('documents_ensure_partition(timestamp)') IS NOT NULL"
+            )
+            partitioned = cur.fetchone()[0]
+
+        # A failed batch is rolled back and dropped so the connection stays usable
+        def flush():
+            if not batch:
+                return
+            try:
+                with conn.cursor() as cur:
+                    if partitioned:
+                        for month in {row[6][:7] + "-01" for row in batch}:
+                            cur.execute("SELECT documents_ensure_partition(%s::timestamp)", (month,))
+                    cur.executemany(insert, batch)
+                conn.commit()
+            except psycopg.Error as e:
+                conn.rollback()
+                logger.error("Dropped batch of %d (ids %s): %s", len(batch), [row[0] for row in batch], e)
+            finally:
+                batch.clear()
+
+        def handle(article: Article) -> List[Article]:
+            if not batch:
+                oldest[0] = time.monotonic()
+            batch.append(
+                (
+                    article.id,
+                    article.title[:200],
+                    article.filepath or None,
+                    len(article.body),
+                    len(article.body.encode("utf-8")),
+                    article.url,
+                    article.time_crawled,
+                    article.body,
+                )
+            )
+            if len(batch) >= batch_size or (
+                flush_interval is not None and time.monotonic() - oldest[0] >= flush_interval
+            ):
+                flush()
+            return [article]
+
+        def close():
+            flush()
+            conn.close()
+
+        handle.close = close
+        if flush_interval is not None:
+            handle.idle = flush
+            handle.idle_timeout = flush_interval
+        return handle
+
+    return factory
+
+
+def null_handler() -> Callable:
+    return lambda article: [article]
+
+
+# Ids continue after the largest one in the table and known urls are skipped
+def db_state(conf: dict):
+    import psycopg
+
+    with psycopg.connect(**conf) as conn, conn.cursor() as cur:
+        cur.execute("SELECT coalesce(max(id), -1) + 1 FROM documents")
+        next_id = cur.fetchone()[0]
+        cur.execute("SELECT doc_url FROM documents")
+        seen = {row[0] for row in cur}
+
+    return next_id, seen
+
+
+class Pipeline:
+    def __init__(self, stages: List[tuple], queue_size: int = 64):
+        self.source: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stages: List[Stage] = []
+
+        inbox = self.source
+        for i, (name, factory, workers) in enumerate(stages):
+            outbox = queue.Queue(maxsize=queue_size) if i < len(stages) - 1 else None
+            self.stages.append(Stage(name, factory, workers, inbox, outbox))
+            inbox = outbox
+
+        for stage, nxt in zip(self.stages, self.stages[1:]):
+            stage.downstream_workers = len(nxt.threads)
+
+    def run(self, items: Iterable) -> float:
+        start = time.perf_counter()
+
+        for stage in self.stages:
+            stage.start()
+
+        for item in items:
+            self.source.put(item)
+        for _ in self.stages[0].threads:
+            self.source.put(_DONE)
+
+        for stage in self.stages:
+            stage.join()
+
+        return time.perf_counter() - start
+
+    # Per stage throughput, the bottleneck is the stage with the busiest workers
+    def report(self, wall: float) -> None:
+        logger.info(
+            "%-10s %7s %7s %6s %8s %9s %10s %8s",
+            "stage", "in", "out", "errors", "items/s", "util(%)", "blocked(s)", "idle(s)",
+        )
+
+        utilisation = {}
+        for stage in self.stages:
+            s = stage.stats
+            util = s.busy / (s.workers * wall) if wall else 0
+            utilisation[s.name] = util
+            logger.info(
+                "%-10s %7d %7d %6d %8.2f %9.1f %10.2f %8.2f",
+                s.name,
+                s.items_in,
+                s.items_out,
+                s.errors,
+                s.items_out / wall if wall else 0,
+                100 * util,
+                s.blocked_put,
+                s.starved,
+            )
+
+        bottleneck = max(utilisation, key=utilisation.get)
+        logger.info(
+            "Finished in %.2fs, bottleneck: %s (%.1f%% busy), consider raising its workers",
+            wall,
+            bottleneck,
+            100 * utilisation[bottleneck],
+        )
+
+
+# Options shared with crawl_daemon.py
+def add_stage_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--config", default="postgre.ini", help="database .ini file")
+    parser.add_argument("--articles", help="also write preprocessed article{i}.txt here")
+    parser.add_argument("--dedup", type=float, default=0.0, help="near duplicate threshold, 0 disables")
+    parser.add_argument("--dry-run", action="store_true", help="run every stage but skip the database")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--failures", default="fetch_failures.csv", help="CSV log of urls that couldn't be fetched")
+    for stage, default in (("fetch", 8), ("extract", 4), ("preprocess", 2), ("ingest", 1)):
+        parser.add_argument(f"--{stage}-workers", type=int, default=default)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--links", help="read links from a links.csv instead of scraping")
+    parser.add_argument("--html-dir", help="read doc{i}.html from a directory instead of fetching (needs --links)")
+    add_stage_arguments(parser)
+
+    return parser.parse_args()
+
+
+# fetch -> extract -> preprocess -> ingest, new ids start at next_id
+def downstream_stages(
+    args, conf: dict | None, next_id: int, flush_interval: float | None = None
+) -> List[tuple]:
+    if args.articles:
+        os.makedirs(args.articles, exist_ok=True)
+
+    html_dir = getattr(args, "html_dir", None)
+
+    return [
+        (
+            "fetch",
+            local_fetch_handler(html_dir) if html_dir else fetch_handler(failures=args.failures),
+            args.fetch_workers,
+        ),
+        (
+            "extract",
+            extract_handler(
+                MinHashLSH.load(threshold=args.dedup) if args.dedup else None, args.extract_workers
+            ),
+            args.extract_workers,
+        ),
+        (
+            "preprocess",
+            preprocess_handler(args.articles, itertools.count(next_id)),
+            args.preprocess_workers,
+        ),
+        (
+            "ingest",
+            null_handler if args.dry_run else ingest_handler(conf, flush_interval=flush_interval),
+            args.ingest_workers,
+        ),
+    ]
+
+
+def main():
+    args = parse_args()
+
+    if args.links:
+        from crawler import PoliticsCrawler
+
+        urls = PoliticsCrawler.get_all_links(args.links)
+        source = [Article(url) for url in urls]
+        if args.html_dir:
+            for i, article in enumerate(source):
+                article.html_path = f"doc{i}.html"
+    else:
+        source = BASE_URLS
+
+    next_id, seen, conf = 0, set(), None
+    if not args.dry_run:
+        from text_query import read_from_config
+
+        conf = read_from_config(args.config)
+        next_id, seen = db_state(conf)
+        logger.info("Starting at id %d, %d urls already stored", next_id, len(seen))
+
+    if args.links:
+        source = [a for a in source if a.url not in seen]
+        stages = []
+    else:
+        stages = [("discover", discover_handler(seen), len(BASE_URLS))]
+
+    stages += downstream_stages(args, conf, next_id)
+
+    pipeline = Pipeline(stages, queue_size=args.queue_size)
+    wall = pipeline.run(source)
+    pipeline.report(wall)
+
+    # Fold the new lexemes into the autocomplete lexicon
+    if not args.dry_run:
+        import psycopg
+
+        import suggest
+
+        with psycopg.connect(**conf) as conn:
+            suggest.update(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Phrase, proximity and boolean search syntax compiled to a Postgres tsquery
+
+    κυβέρνηση ΔΕΗ                    every term (same as plainto_tsquery)
+    "Εκλογές ΚΙΝΑΛ"                  phrase, words adjacent and in order
+    ΔΕΗ NEAR/3 λογαριασμοί           at most 3 words apart, either order
+    Μητσοτάκης OR Τσίπρας            either term
+    εκλογές NOT ΚΙΝΑΛ, εκλογές -ΚΙΝΑΛ  exclude a term
+    (ΔΕΗ OR ΔΕΔΔΗΕ) λογαριασμοί      grouping
+
+Operators are uppercase; anything else is a search word. The compiled text
+goes to to_tsquery('greek', ...), which stems words and drops stopwords
+just like plainto_tsquery, so phrases, distances and exclusions are checked
+against the positions in docvec by the index itself.
+
+    $ python query_parser.py '"Εκλογές ΚΙΝΑΛ" NOT Ανδρουλάκης'
+"""
+import re
+import sys
+from typing import List, Tuple
+
+MAX_NEAR = 10
+
+TOKEN_RE = re.compile(r'"[^"]*"?|\(|\)|(?<![^\s(])-(?=[\w"(])|\bNEAR/\d+\b|\w+')
+OPERATORS = {"AND", "OR", "NOT"}
+
+Node = Tuple
+
+
+class QueryParser:
+    """Recursive descent over the tokens of one query
+
+    query := or ; or := and ("OR" and)* ; and := unary ("AND"? unary)*
+    unary := ("NOT" | "-") unary | near ; near := atom ("NEAR/N" atom)*
+    atom  := "phrase" | word | "(" or ")"
+    """
+
+    def __init__(self, text: str):
+        self.tokens = TOKEN_RE.findall(text)
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def parse(self) -> Node | None:
+        nodes = []
+        while self.peek() is not None:
+            node = self.parse_or()
+            if node is not None:
+                nodes.append(node)
+            elif self.peek() is not None:
+                self.take()  # stray ")" or operator
+
+        return combine("and", nodes)
+
+    def parse_or(self) -> Node | None:
+        nodes = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            nodes.append(self.parse_and())
+
+        return combine("or", [n for n in nodes if n is not None])
+
+    def parse_and(self) -> Node | None:
+        nodes = []
+        while (tok := self.peek()) is not None and tok not in ("OR", ")"):
+            if tok == "AND":
+                self.take()
+                continue
+            node = self.parse_unary()
+            if node is None:
+                break
+            nodes.append(node)
+
+        return combine("and", nodes)
+
+    def parse_unary(self) -> Node | None:
+        if self.peek() in ("NOT", "-"):
+            self.take()
+            node = self.parse_unary()
+            return ("not", node) if node is not None else None
+
+        return self.parse_near()
+
+    def parse_near(self) -> Node | None:
+        node = self.parse_atom()
+        while node is not None and (tok := self.peek()) is not None and tok.startswith("NEAR/"):
+            self.take()
+            right = self.parse_atom()
+            if right is None:
+                break
+            node = ("near", node, right, min(max(int(tok[5:]), 1), MAX_NEAR))
+
+        return node
+
+    def parse_atom(self) -> Node | None:
+        tok = self.peek()
+        if tok is None or tok in OPERATORS or tok in (")", "-") or tok.startswith("NEAR/"):
+            return None
+
+        self.take()
+        if tok == "(":
+            node = self.parse_or()
+            if self.peek() == ")":
+                self.take()
+            return node
+        if tok.startswith('"'):
+            words = re.findall(r"\w+", tok)
+            if not words:
+                return None
+            return ("phrase", words) if len(words) > 1 else ("term", words[0])
+
+        return ("term", tok)
+
+
+def combine(op: str, nodes: List[Node]) -> Node | None:
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else (op, nodes)
+
+
+def parse(text: str) -> Node | None:
+    return QueryParser(text).parse()
+
+
+def compile_node(node: Node) -> str:
+    kind = node[0]
+
+    if kind == "term":
+        return f"'{node[1]}'"
+    if kind == "phrase":
+        return "'" + " ".join(node[1]) + "'"
+    if kind == "not":
+        return "!" + compile_node(node[1])
+    if kind in ("and", "or"):
+        sep = " & " if kind == "and" else " | "
+        return "(" + sep.join(compile_node(n) for n in node[1]) + ")"
+    if kind == "near":
+        left, right = compile_node(node[1]), compile_node(node[2])
+        return "(" + " | ".join(
+            f"{a} <{d}> {b}" for d in range(1, node[3] + 1) for a, b in ((left, right), (right, left))
+        ) + ")"
+
+    raise ValueError(f"Unknown node {kind}")
+
+
+def positive_terms(node: Node | None) -> List[str]:
+    """Words a matching document may contain, i.e. everything not under NOT"""
+    if node is None or node[0] == "not":
+        return []
+    if node[0] == "term":
+        return [node[1]]
+    if node[0] == "phrase":
+        return list(node[1])
+    if node[0] == "near":
+        return positive_terms(node[1]) + positive_terms(node[2])
+
+    return [w for n in node[1] for w in positive_terms(n)]
+
+
+# Text for to_tsquery('greek', ...), "" when there's nothing to search for
+def to_tsquery_text(user_input: str) -> str:
+    node = parse(user_input)
+    if node is None:
+        return ""
+    if not positive_terms(node):
+        raise ValueError(f"Query [{user_input}] only excludes terms")
+
+    text = compile_node(node)
+    return text[1:-1] if node[0] in ("and", "or") else text
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) > 1, "Not enough arguments: <query>"
+
+    print(parse(sys.argv[1]))
+    print(to_tsquery_text(sys.argv[1]))
@@ -10,6 +10,7 @@ import requests
 from bs4 import BeautifulSoup
 
 from extract import VALID_SITES
+from utils.metrics import incr, span, timed
 
 ses = requests.session()
 
@@ -49,12 +50,15 @@ def get_news247(soup: BeautifulSoup) -> List[str]:
 
 
 # Perform GET request to every website and gather links
+@timed("scraper.get_latest_from_url")
 def get_latest_from_url(url):
     ses.cookies.clear()
-    res = ses.get(url, timeout=2, headers={"Content-Type": "text/html; charset=UTF-8"})
+    with span("scraper.fetch"):
+        res = ses.get(url, timeout=2, headers={"Content-Type": "text/html; charset=UTF-8"})
 
     if res.ok:
-        soup = BeautifulSoup(res.text, "html.parser")
+        with span("scraper.parse"):
+            soup = BeautifulSoup(res.text, "html.parser")
         base_url = re.split(r"\b(?:(/)(?!\1))+\b", url)[0]
 
         if base_url in VALID_SITES:
@@ -72,6 +76,7 @@ def get_latest_from_url(url):
                 res = get_news247(soup)
                 logger.info(f"Found {len(res)} articles from {base_url}")
 
+            incr("scraper.links", len(res))
             return res
         raise ValueError("Provided URL is invalid")
 
@@ -98,6 +103,7 @@ def get_num_lines(filepath: str) -> int:
 
 
 # Write gathered links to a CSV file
+@timed("scraper.links_to_file")
 def links_to_file(outfile: str, links: List[str], override: bool = False):
 
     fmode, start_idx = "w", 0
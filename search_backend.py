@@ -0,0 +1,344 @@
+"""Search backends behind text_query.py: Postgres or an embedded SQLite FTS5 file
+
+Both answer `search(user_input, *columns, k, metric, **filters)` with rows
+that have the requested columns plus a `rank`, so normalize_rank and
+display_results work on either. The SQLite backend needs no server: titles
+and bodies are folded with the same strip_accents_and_lowercase as
+extract_body.py, Greek stopwords are dropped from the query like
+plainto_tsquery does, and matches are ranked with FTS5's bm25 (title
+weighted x2). Phrases, NEAR/N, OR and NOT (see query_parser.py) are compiled
+to their FTS5 counterparts. ts_rank_cd normalizations (metric) only apply
+to Postgres.
+
+    $ python search_backend.py import csv_files/outfile.csv [csv_files/article_path.csv] [db]
+    $ python search_backend.py compare csv_files/outfile.csv [rounds] [k]
+    $ python text_query.py "Εκλογές ΚΙΝΑΛ" no_doc_length 10 --backend sqlite
+"""
+import csv
+import logging
+import re
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from statistics import median
+from typing import Dict, List, NamedTuple
+
+from query_parser import Node, parse, positive_terms
+from utils.lexicon import is_stopword, strip_accents_and_lowercase
+from utils.sites import site_host
+
+logger = logging.getLogger()
+
+DEFAULT_SQLITE_DB = "documents.sqlite3"
+MAX_RESULTS = 100
+QUERIES = ("κυβέρνηση", "λογαριασμοί ΔΕΗ", "νοικοκυριά", "συνάντηση πρωθυπουργού", "Εκλογές ΚΙΝΑΛ")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    filepath TEXT,
+    length INTEGER NOT NULL DEFAULT 0,
+    size_kb INTEGER NOT NULL DEFAULT 0,
+    doc_url TEXT,
+    site TEXT,
+    time_crawled TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS site_time_crawled_idx ON documents (site, time_crawled);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(title, body, content='');
+"""
+COLUMNS = ("id", "title", "filepath", "length", "size_kb", "doc_url", "site", "time_crawled")
+SITE_RE = re.compile(r"^https?://(?:www\.)?([^/]+)")
+
+
+class PostgresBackend:
+    def __init__(self, conf: Dict[str, str]):
+        from text_query import initialize_conn
+
+        self.connection = initialize_conn(conf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+        logger.info("Connection to database closed")
+
+    def search(
+        self, user_input: str, *columns: str, k: int = 10, metric: int = 0, **filters
+    ) -> List[NamedTuple]:
+        from text_query import execute_similarity_query, prep_query
+
+        query = prep_query(user_input, *columns, metric=metric, **filters)
+        return execute_similarity_query(query, self.connection, k)
+
+
+class SQLiteBackend:
+    def __init__(self, path: str = DEFAULT_SQLITE_DB):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        # Committed right away, otherwise the open transaction holds the write
+        # lock for as long as the connection lives and blocks an import
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO documents_fts (documents_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"
+            )
+        logger.info("Opened %s", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    # FTS5 expression of the query, "" when there's nothing to search for
+    @staticmethod
+    def match_expression(user_input: str) -> str:
+        node = parse(user_input)
+        if node is None:
+            return ""
+        if not positive_terms(node):
+            raise ValueError(f"Query [{user_input}] only excludes terms")
+
+        return fts5_expression(node) or ""
+
+    @staticmethod
+    def filter_conditions(site: str | None = None, since: str | None = None, until: str | None = None):
+        conditions, params = "", []
+        if site:
+            conditions += " AND d.site = ?"
+            params.append(site_host(site))
+        if since:
+            conditions += " AND d.time_crawled >= ?"
+            params.append(since)
+        if until:
+            conditions += " AND d.time_crawled < ?"
+            params.append(until)
+
+        return conditions, params
+
+    def search(
+        self, user_input: str, *columns: str, k: int = 10, metric: int = 0, **filters
+    ) -> List[NamedTuple]:
+        if k > MAX_RESULTS:
+            raise ValueError(
+                f"Results set exceeds max number of instances to return {k} > {MAX_RESULTS}"
+            )
+        if unknown := set(columns) - set(COLUMNS):
+            raise ValueError(f"Unknown columns {unknown}")
+
+        expression = self.match_expression(user_input)
+        if not expression:
+            return []
+
+        conditions, params = self.filter_conditions(**filters)
+        cur = self.connection.execute(
+            f"SELECT {', '.join('d.' + c for c in columns)}, -documents_fts.rank AS rank "
+            "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+            f"WHERE documents_fts MATCH ?{conditions} ORDER BY documents_fts.rank LIMIT ?",
+            (expression, *params, k),
+        )
+
+        Row = namedtuple("Row", (*columns, "rank"))
+        return [Row(*row) for row in cur]
+
+    # Load outfile.csv (and the article{i}.txt paths), skipping ids already stored
+    def load(self, outfile: str, paths: str | None = None, batch_size: int = 1000) -> int:
+        csv.field_size_limit(sys.maxsize)
+
+        filepaths = {}
+        if paths:
+            with open(paths, mode="r", encoding="utf-8") as infile:
+                reader = csv.reader(infile)
+                next(reader)
+                filepaths = {int(i): p for i, p in reader}
+
+        known = {row[0] for row in self.connection.execute("SELECT id FROM documents")}
+        docs, texts, n_new = [], [], 0
+
+        def flush() -> None:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)", docs
+                )
+                self.connection.executemany(
+                    "INSERT INTO documents_fts (rowid, title, body) VALUES (?, ?, ?)", texts
+                )
+            docs.clear()
+            texts.clear()
+
+        with open(outfile, mode="r", encoding="utf-8") as infile:
+            reader = csv.reader(infile)
+            next(reader)
+            for doc_id, title, body, length, size, url, wall_time in reader:
+                doc_id = int(doc_id)
+                if doc_id in known:
+                    continue
+
+                site = SITE_RE.match(url)
+                docs.append(
+                    (doc_id, title, filepaths.get(doc_id), int(length), int(size), url,
+                     site.group(1).lower() if site else None, wall_time)
+                )
+                texts.append(
+                    (doc_id, strip_accents_and_lowercase(title), strip_accents_and_lowercase(body))
+                )
+                n_new += 1
+                if len(docs) >= batch_size:
+                    flush()
+
+        flush()
+        with self.connection:
+            self.connection.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+
+        logger.info("Loaded %d new documents into %s", n_new, self.path)
+
+        return n_new
+
+
+def fts5_phrase(words: List[str]) -> str:
+    return '"' + " ".join(strip_accents_and_lowercase(w) for w in words) + '"'
+
+
+# FTS5 text of a query_parser node, None if only stopwords are left. NOT is a
+# binary operator in FTS5, so excluded terms are subtracted from the rest of
+# their AND group, and NEAR only takes words and phrases
+def fts5_expression(node: Node) -> str | None:
+    kind = node[0]
+
+    if kind == "term":
+        return None if is_stopword(node[1]) else fts5_phrase([node[1]])
+    if kind == "phrase":
+        return fts5_phrase(node[1])
+    if kind == "near":
+        sides = [n for n in node[1:3] if n[0] in ("term", "phrase")]
+        if len(sides) != 2:
+            raise ValueError("NEAR/N only takes words or phrases on the sqlite backend")
+        words = [[n[1]] if n[0] == "term" else n[1] for n in sides]
+        # FTS5 counts the tokens in between, NEAR/1 means adjacent
+        return f"NEAR({fts5_phrase(words[0])} {fts5_phrase(words[1])}, {node[3] - 1})"
+    if kind == "or":
+        if any(n[0] == "not" for n in node[1]):
+            raise ValueError("NOT can't be ORed on the sqlite backend")
+        parts = [p for p in map(fts5_expression, node[1]) if p]
+        return "(" + " OR ".join(parts) + ")" if parts else None
+    if kind == "and":
+        parts = [p for p in (fts5_expression(n) for n in node[1] if n[0] != "not") if p]
+        excluded = [p for p in (fts5_expression(n[1]) for n in node[1] if n[0] == "not") if p]
+        if not parts:
+            if excluded:
+                raise ValueError("NOT needs something to exclude from on the sqlite backend")
+            return None
+        expression = "(" + " AND ".join(parts) + ")"
+        for p in excluded:
+            expression = f"({expression} NOT {p})"
+        return expression
+    if kind == "not":
+        raise ValueError("NOT needs something to exclude from on the sqlite backend")
+
+    raise ValueError(f"Unknown node {kind}")
+
+
+# --backend postgres | sqlite[:<path>] | index[:<dir>] (see inverted_index.py)
+def open_backend(spec: str = "postgres", conf_file: str = "postgre.ini"):
+    name, _, path = spec.partition(":")
+
+    if name == "sqlite":
+        return SQLiteBackend(path or DEFAULT_SQLITE_DB)
+    if name == "index":
+        from inverted_index import DEFAULT_INDEX_DIR, InvertedIndex
+
+        return InvertedIndex(path or DEFAULT_INDEX_DIR)
+    if name == "postgres":
+        from text_query import read_from_config
+
+        return PostgresBackend(read_from_config(conf_file))
+
+    raise ValueError(f"Unknown backend {spec}, expected postgres, sqlite[:<path>] or index[:<dir>]")
+
+
+# Latency percentiles and sequential throughput of one backend
+def measure(backend, queries: List[str], rounds: int = 20, k: int = 10) -> Dict:
+    for q in queries:
+        backend.search(q, "title", "filepath", k=k)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for q in queries:
+            t0 = time.perf_counter()
+            backend.search(q, "title", "filepath", k=k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return dict(
+        p50_ms=round(median(latencies), 3),
+        p95_ms=round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+        qps=round(len(latencies) / wall, 1),
+    )
+
+
+# Same corpus and queries on both backends; Postgres is skipped if unreachable
+def compare(outfile: str, rounds: int = 20, k: int = 10, conf_file: str = "postgre.ini") -> Dict:
+    import tempfile
+
+    report = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with SQLiteBackend(f"{tmp}/compare.sqlite3") as backend:
+            start = time.perf_counter()
+            backend.load(outfile)
+            logger.info("SQLite import took %.2fs", time.perf_counter() - start)
+
+            logging.disable(logging.INFO)
+            report["sqlite"] = measure(backend, QUERIES, rounds, k)
+            logging.disable(logging.NOTSET)
+
+    try:
+        backend = open_backend("postgres", conf_file)
+    except Exception as e:
+        logger.warning("Skipping postgres: %s", e)
+    else:
+        with backend:
+            logging.disable(logging.INFO)
+            report["postgres"] = measure(backend, QUERIES, rounds, k)
+            logging.disable(logging.NOTSET)
+
+    for name, row in report.items():
+        logger.info("%-8s %s", name, row)
+
+    return report
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        format="[%(levelname)-7s] %(asctime)s: %(message)s",
+        datefmt="%d/%m/%Y %H:%M:%S",
+        level=logging.INFO,
+    )
+
+    assert len(sys.argv) > 2, (
+        "Not enough arguments: import <outfile.csv> [article_path.csv] [db] | "
+        "compare <outfile.csv> [rounds] [k]"
+    )
+
+    if sys.argv[1] == "import":
+        with SQLiteBackend(sys.argv[4] if len(sys.argv) > 4 else DEFAULT_SQLITE_DB) as backend:
+            backend.load(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif sys.argv[1] == "compare":
+        compare(
+            sys.argv[2],
+            rounds=int(sys.argv[3]) if len(sys.argv) > 3 else 20,
+            k=int(sys.argv[4]) if len(sys.argv) > 4 else 10,
+        )
+    else:
+        raise ValueError(f"Unknown mode {sys.argv[1]}")
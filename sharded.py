@@ -0,0 +1,177 @@
+"""Scatter-gather search over several Postgres shards
+
+Every section of postgre.ini named [shard<N>] is one shard, with the same keys
+as [credentials]. Documents are placed by hash of their id (or by month of
+time_crawled) and each query runs concurrently on all shards; the per-shard
+top-k lists come back sorted by rank and are merged with a heap.
+
+ts_rank_cd only looks at the document itself (no corpus statistics), so raw
+ranks are comparable across shards and are min-max scaled once, after the
+merge, exactly like normalize_rank does for a single database.
+
+Testing with local instances, e.g.
+
+    $ for p in 5433 5434; do initdb -D /tmp/shard$p && pg_ctl -D /tmp/shard$p -o "-p $p" start; done
+    $ for p in 5433 5434; do psql -p $p -f sql/create-db-partitioned.sql; done
+    $ python sharded.py load csv_files/outfile.csv csv_files/article_path.csv
+    $ python sharded.py search "Εκλογές ΚΙΝΑΛ" no_doc_length 10
+"""
+import csv
+import heapq
+import logging
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, NamedTuple, Tuple
+
+import psycopg
+
+from text_query import (
+    MAX_RESULTS,
+    display_results,
+    execute_similarity_query,
+    normalize_rank,
+    prep_query,
+    rank_bounds,
+    read_from_config,
+    validate_metric,
+)
+
+logger = logging.getLogger()
+
+
+def read_shards(conf_file: str = "postgre.ini") -> List[Dict[str, str]]:
+    config = ConfigParser(allow_no_value=False)
+    config.read(conf_file)
+
+    sections = sorted(
+        (s for s in config.sections() if s.startswith("shard")),
+        key=lambda s: int("".join(filter(str.isdigit, s)) or 0),
+    )
+    if not sections:
+        raise RuntimeError(f"No [shard<N>] sections in {conf_file}")
+
+    return [read_from_config(conf_file, section) for section in sections]
+
+
+# Shard of a document, by hash of its id or by month of time_crawled
+def shard_for(doc_id: int, time_crawled: str, n_shards: int, by: str = "hash") -> int:
+    if by == "time":
+        ts = datetime.fromisoformat(time_crawled)
+        return (ts.year * 12 + ts.month) % n_shards
+
+    return zlib.crc32(str(doc_id).encode()) % n_shards
+
+
+class ShardSet:
+    def __init__(self, confs: List[Dict[str, str]]):
+        self.connections = [psycopg.connect(**conf) for conf in confs]
+        self.pool = ThreadPoolExecutor(max_workers=len(self.connections))
+        logger.info("Connected to %d shards", len(self.connections))
+
+    def __enter__(self) -> "ShardSet":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        for conn in self.connections:
+            conn.close()
+
+    # Run fn(connection) on every shard concurrently
+    def scatter(self, fn) -> List:
+        return list(self.pool.map(fn, self.connections))
+
+    def search(
+        self, user_input: str, *columns: str, k: int = 10, metric: int = 0, **filters
+    ) -> List[NamedTuple]:
+        """Global top k: per-shard top k lists merged on rank"""
+        query = prep_query(user_input, *columns, metric=metric, **filters)
+
+        per_shard = self.scatter(lambda conn: execute_similarity_query(query, conn, k))
+        logger.info("Got %s rows from the shards", [len(r) for r in per_shard])
+
+        return list(islice(heapq.merge(*per_shard, key=lambda row: -row.rank), k))
+
+    # (min, max) rank over all shards, for scaling pages or streams consistently
+    def global_bounds(self, user_input: str, metric: int = 0, **filters) -> Tuple[float, float]:
+        bounds = [
+            b
+            for b in self.scatter(lambda conn: rank_bounds(user_input, conn, metric, **filters))
+            if b[0] is not None
+        ]
+        if not bounds:
+            return (None, None)
+
+        return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+    # Split outfile.csv and article_path.csv across the shards
+    def load(self, outfile: str, paths: str, by: str = "hash", batch_size: int = 500) -> None:
+        with open(paths, mode="r", encoding="utf-8") as infile:
+            reader = csv.reader(infile)
+            next(reader)
+            filepaths = {int(i): p for i, p in reader}
+
+        insert = (
+            "INSERT INTO documents (id, title, filepath, length, size_kb, doc_url, time_crawled, docvec) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, to_tsvector('greek', %s)) ON CONFLICT DO NOTHING"
+        )
+        batches: List[List[tuple]] = [[] for _ in self.connections]
+        counts = [0] * len(self.connections)
+
+        def flush(shard: int) -> None:
+            conn = self.connections[shard]
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT to_regprocedure('documents_ensure_partition(timestamp)') IS NOT NULL"
+                )
+                if cur.fetchone()[0]:
+                    for month in {row[6][:7] + "-01" for row in batches[shard]}:
+                        cur.execute("SELECT documents_ensure_partition(%s::timestamp)", (month,))
+                cur.executemany(insert, batches[shard])
+            conn.commit()
+            counts[shard] += len(batches[shard])
+            batches[shard].clear()
+
+        with open(outfile, mode="r", encoding="utf-8") as infile:
+            reader = csv.reader(infile)
+            next(reader)
+            for doc_id, title, body, length, size, url, wall_time in reader:
+                shard = shard_for(int(doc_id), wall_time, len(self.connections), by)
+                batches[shard].append(
+                    (int(doc_id), title, filepaths.get(int(doc_id)), int(length), int(size), url, wall_time, body)
+                )
+                if len(batches[shard]) >= batch_size:
+                    flush(shard)
+
+        for shard in range(len(self.connections)):
+            if batches[shard]:
+                flush(shard)
+
+        logger.info("Loaded %s documents per shard", counts)
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) > 3, (
+        "Not enough arguments: search <query> <metric> <max_res> | "
+        "load <outfile.csv> <article_path.csv> [hash|time]"
+    )
+
+    with ShardSet(read_shards()) as shards:
+        if sys.argv[1] == "load":
+            shards.load(sys.argv[2], sys.argv[3], by=sys.argv[4] if len(sys.argv) > 4 else "hash")
+        else:
+            max_res = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+            if max_res > MAX_RESULTS:
+                raise ValueError(f"{max_res} > {MAX_RESULTS}")
+
+            results = shards.search(
+                sys.argv[2], "title", "filepath", k=max_res, metric=validate_metric(sys.argv[3])
+            )
+            display_results(normalize_rank(results))
@@ -0,0 +1,21 @@
+/*
+    Site and crawl time filters for text_query.py (--site, --since, --until).
+    Works on both create-db.sql and create-db-partitioned.sql tables and is
+    included by both, run it by hand only to upgrade an existing database.
+
+    1. site is a stored column derived from doc_url, e.g. 'in.gr'.
+
+    2. btree_gin lets a single GIN index answer "site = X AND query @@ docvec",
+       so a filtered search only visits the postings of that site.
+
+    Example: $ psql -U postgres -f add-site-filter.sql -d test_db
+*/
+
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS site TEXT
+    GENERATED ALWAYS AS (lower(substring(doc_url from '^https?://(?:www\.)?([^/]+)'))) STORED;
+
+CREATE INDEX IF NOT EXISTS docvec_site_idx ON documents USING GIN (site, docvec);
+CREATE INDEX IF NOT EXISTS site_time_crawled_idx ON documents (site, time_crawled);
+CREATE INDEX IF NOT EXISTS time_crawled_brin_idx ON documents USING BRIN (time_crawled);
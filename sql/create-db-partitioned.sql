@@ -0,0 +1,75 @@
+/*
+    Scale-ready documents schema, safe to run more than once.
+
+    1. documents is partitioned by month of time_crawled, partitions are named
+       documents_yYYYYmMM and created on demand by documents_ensure_partition().
+
+    2. BIGINT ids, INTEGER lengths and TEXT paths (the old schema stopped at
+       32,767 SMALLINT ids and overflowed on long articles).
+
+    3. The GIN index on docvec and the BRIN index on time_crawled are declared
+       on the parent so every partition gets its own copy. Searches with a
+       time_crawled range only touch the matching partitions.
+
+    Example: $ psql -U postgres -f create-db-partitioned.sql -d test_db
+             then load with load-partitioned.sql or migrate with migrate-partitioned.sql
+*/
+
+CREATE TABLE IF NOT EXISTS documents (
+    id BIGINT NOT NULL,
+    title VARCHAR ( 200 ) NOT NULL,
+    filepath TEXT NULL,
+    length INTEGER NOT NULL DEFAULT 0,
+    size_kb INTEGER NOT NULL DEFAULT 0,
+    doc_url TEXT,
+    time_crawled TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+    docvec TSVECTOR,
+    PRIMARY KEY (id, time_crawled)
+) PARTITION BY RANGE (time_crawled);
+
+CREATE INDEX IF NOT EXISTS docvec_idx ON documents USING GIN (docvec);
+CREATE INDEX IF NOT EXISTS time_crawled_brin_idx ON documents USING BRIN (time_crawled);
+CREATE INDEX IF NOT EXISTS doc_url_idx ON documents (doc_url);
+
+/* Site column and indexes for filtered searches */
+\ir add-site-filter.sql
+
+/* Create (if missing) the monthly partition holding ts, returns its name */
+CREATE OR REPLACE FUNCTION documents_ensure_partition(ts TIMESTAMP) RETURNS TEXT AS $$
+DECLARE
+    lo TIMESTAMP := date_trunc('month', ts);
+    part TEXT := format('documents_y%sm%s', to_char(ts, 'YYYY'), to_char(ts, 'MM'));
+BEGIN
+    IF to_regclass(part) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF documents FOR VALUES FROM (%L) TO (%L)',
+            part, lo, lo + INTERVAL '1 month'
+        );
+    END IF;
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+/* Detach every partition that ends on or before cutoff, the tables are kept
+   so they can be archived (pg_dump -t) and dropped separately */
+CREATE OR REPLACE FUNCTION documents_detach_before(cutoff TIMESTAMP) RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'documents'::regclass
+          AND c.relname ~ '^documents_y\d{4}m\d{2}$'
+          AND to_timestamp(substr(c.relname, 12, 4) || substr(c.relname, 17, 2), 'YYYYMM')
+              + INTERVAL '1 month' <= cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE documents DETACH PARTITION %I', part.relname);
+        RETURN NEXT part.relname;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+/* Current month is always available for the streaming pipeline */
+SELECT documents_ensure_partition(now()::TIMESTAMP);
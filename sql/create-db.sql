@@ -5,18 +5,21 @@
        LOCAL_PATH using the csv file after running get_local_link.py
        
     Example: $ psql -U postgres -f create-db.sql -d test_db -a -v CSV_PATH=/path/to/outfile.csv -v LOCAL_PATH=/path/to/article_path.csv
+
+    3. For large or continuously updated corpora use create-db-partitioned.sql and
+       load-partitioned.sql instead, which don't drop the table on every reload.
 */
 
 DROP TABLE IF EXISTS documents CASCADE;
 
 CREATE TABLE documents (
-    id SMALLINT UNIQUE PRIMARY KEY,
+    id BIGINT UNIQUE PRIMARY KEY,
     body TEXT NOT NULL,
     title VARCHAR ( 200 ) NOT NULL,
-    filepath VARCHAR ( 100 ) NULL,
-    length SMALLINT NOT NULL DEFAULT 0,
+    filepath TEXT NULL,
+    length INTEGER NOT NULL DEFAULT 0,
     size_kb INT NOT NULL DEFAULT 0,
-    doc_url VARCHAR ( 250 ),
+    doc_url TEXT,
     time_crawled TIMESTAMP WITHOUT TIME ZONE
 );
 
@@ -25,7 +28,7 @@ COPY documents(id, title, body, length, size_kb, doc_url, time_crawled)
 FROM PROGRAM 'awk FNR-1 ':'CSV_PATH'' | cat' DELIMITER ',' CSV;
 
 /* Create a temp table to load the actual paths stored locally */
-CREATE TEMPORARY TABLE temp_dest (id SMALLINT, filepath_ VARCHAR ( 100 ) NULL);
+CREATE TEMPORARY TABLE temp_dest (id BIGINT, filepath_ TEXT NULL);
 COPY temp_dest FROM PROGRAM 'awk FNR-1 ':'LOCAL_PATH'' | cat' DELIMITER ',' CSV;
 
 /* Add Ts Vector column */
@@ -42,4 +45,7 @@ UPDATE documents SET filepath = (select filepath_ from temp_dest where documents
 ALTER TABLE documents DROP COLUMN IF EXISTS body CASCADE; 
 
 /* Add Index on documents vectors column */
-CREATE INDEX docvec_idx ON documents USING GIN (docvec);
\ No newline at end of file
+CREATE INDEX docvec_idx ON documents USING GIN (docvec);
+
+/* Site column and indexes for filtered searches */
+\ir add-site-filter.sql
\ No newline at end of file
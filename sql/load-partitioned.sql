@@ -0,0 +1,42 @@
+/*
+    Incremental load into the partitioned schema of create-db-partitioned.sql.
+    Unlike create-db.sql nothing is dropped: rows whose doc_url is already
+    stored are skipped, so the same CSV files can be loaded again. The primary
+    key (id, time_crawled) can't catch that since extract.py stamps every run
+    with the current time, and a unique key on a partitioned table has to
+    include time_crawled, so the check goes through doc_url_idx instead.
+    Loads are meant to run one at a time.
+
+    Example: $ psql -U postgres -f load-partitioned.sql -d test_db -a -v CSV_PATH=/path/to/outfile.csv -v LOCAL_PATH=/path/to/article_path.csv
+*/
+
+CREATE TEMPORARY TABLE staging (
+    id BIGINT,
+    title VARCHAR ( 200 ),
+    body TEXT,
+    length INTEGER,
+    size_kb INTEGER,
+    doc_url TEXT,
+    time_crawled TIMESTAMP WITHOUT TIME ZONE
+);
+
+/* With Header */
+COPY staging(id, title, body, length, size_kb, doc_url, time_crawled)
+FROM PROGRAM 'awk FNR-1 ':'CSV_PATH'' | cat' DELIMITER ',' CSV;
+
+CREATE TEMPORARY TABLE temp_dest (id BIGINT, filepath_ TEXT NULL);
+COPY temp_dest FROM PROGRAM 'awk FNR-1 ':'LOCAL_PATH'' | cat' DELIMITER ',' CSV;
+
+/* One partition per month present in the batch */
+SELECT documents_ensure_partition(m)
+FROM (SELECT DISTINCT date_trunc('month', time_crawled) AS m FROM staging) months;
+
+INSERT INTO documents (id, title, filepath, length, size_kb, doc_url, time_crawled, docvec)
+SELECT s.id, s.title, t.filepath_, s.length, s.size_kb, s.doc_url, s.time_crawled,
+       to_tsvector('greek', s.body)
+FROM (SELECT DISTINCT ON (doc_url) * FROM staging ORDER BY doc_url, id) s
+LEFT JOIN temp_dest t ON t.id = s.id
+WHERE NOT EXISTS (SELECT 1 FROM documents d WHERE d.doc_url = s.doc_url)
+ON CONFLICT DO NOTHING;
+
+ANALYZE documents;
@@ -0,0 +1,32 @@
+/*
+    Move an existing documents table created by create-db.sql into the
+    partitioned schema of create-db-partitioned.sql in one transaction.
+    The old table is kept as documents_old until it's dropped by hand.
+
+    Example: $ psql -U postgres -f migrate-partitioned.sql -d test_db -v ON_ERROR_STOP=1
+*/
+
+BEGIN;
+
+ALTER TABLE documents RENAME TO documents_old;
+ALTER INDEX IF EXISTS docvec_idx RENAME TO docvec_old_idx;
+ALTER INDEX IF EXISTS documents_pkey RENAME TO documents_old_pkey;
+ALTER INDEX IF EXISTS docvec_site_idx RENAME TO docvec_site_old_idx;
+ALTER INDEX IF EXISTS site_time_crawled_idx RENAME TO site_time_crawled_old_idx;
+ALTER INDEX IF EXISTS time_crawled_brin_idx RENAME TO time_crawled_brin_old_idx;
+
+\ir create-db-partitioned.sql
+
+/* Rows crawled before time_crawled was recorded go to the migration month */
+UPDATE documents_old SET time_crawled = now() WHERE time_crawled IS NULL;
+
+SELECT documents_ensure_partition(m)
+FROM (SELECT DISTINCT date_trunc('month', time_crawled) AS m FROM documents_old) months;
+
+INSERT INTO documents (id, title, filepath, length, size_kb, doc_url, time_crawled, docvec)
+SELECT id, title, filepath, length, size_kb, doc_url, time_crawled, docvec
+FROM documents_old;
+
+COMMIT;
+
+ANALYZE documents;
@@ -0,0 +1,215 @@
+"""Prefix completions over the lexemes of documents.docvec
+
+Lexemes and their document frequencies come from Postgres' ts_stat and are
+kept as parallel sorted arrays keyed by the accent-folded lexeme, so a
+completion is two binary searches plus a top-k over the matching slice.
+The top completions of every 1 and 2 letter prefix are precomputed since
+those slices are the largest.
+
+    $ python suggest.py build            # full rebuild from documents
+    $ python suggest.py update           # merge only docs added since the last build
+    $ python suggest.py complete <prefix> [k]
+"""
+import heapq
+import logging
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+from utils.lexicon import cache_path, strip_accents_and_lowercase
+
+logger = logging.getLogger()
+
+LEXICON_FILE = "lexicon.tsv"
+PRECOMPUTE_PREFIX = 2
+
+
+class Lexicon:
+    def __init__(self, counts: Dict[str, int] | None = None, last_id: int = -1):
+        self.last_id = last_id
+        self.keys: List[str] = []
+        self.lexemes: List[str] = []
+        self.weights = array("I")
+        self.top: Dict[str, List[Tuple[str, int]]] = {}
+        self.build(counts or {})
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def build(self, counts: Dict[str, int], k: int = 10) -> None:
+        entries = sorted((strip_accents_and_lowercase(w), w, n) for w, n in counts.items())
+
+        self.keys = [e[0] for e in entries]
+        self.lexemes = [e[1] for e in entries]
+        self.weights = array("I", (e[2] for e in entries))
+
+        buckets: Dict[str, List[Tuple[int, str]]] = {}
+        for key, lexeme, n in entries:
+            for length in range(1, min(PRECOMPUTE_PREFIX, len(key)) + 1):
+                bucket = buckets.setdefault(key[:length], [])
+                if len(bucket) < k:
+                    heapq.heappush(bucket, (n, lexeme))
+                elif n > bucket[0][0]:
+                    heapq.heapreplace(bucket, (n, lexeme))
+
+        self.top = {
+            prefix: [(w, n) for n, w in sorted(bucket, reverse=True)]
+            for prefix, bucket in buckets.items()
+        }
+
+    def counts(self) -> Dict[str, int]:
+        return dict(zip(self.lexemes, self.weights))
+
+    # Merge document frequencies of newly ingested docs
+    def merge(self, counts: Dict[str, int], last_id: int) -> None:
+        merged = self.counts()
+        for lexeme, n in counts.items():
+            merged[lexeme] = merged.get(lexeme, 0) + n
+
+        self.last_id = max(self.last_id, last_id)
+        self.build(merged)
+
+    def span(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff", lo)
+        return lo, hi
+
+    # Most frequent lexemes starting with prefix, accents and case are ignored
+    def complete(self, prefix: str, k: int = 10) -> List[Tuple[str, int]]:
+        prefix = strip_accents_and_lowercase(prefix.strip())
+        if not prefix:
+            return []
+
+        if len(prefix) <= PRECOMPUTE_PREFIX:
+            return self.top.get(prefix, [])[:k]
+
+        lo, hi = self.span(prefix)
+        best = heapq.nlargest(k, range(lo, hi), key=self.weights.__getitem__)
+
+        return [(self.lexemes[i], self.weights[i]) for i in best]
+
+    def has_prefix(self, prefix: str) -> bool:
+        lo, hi = self.span(strip_accents_and_lowercase(prefix))
+        return hi > lo
+
+    def save(self, path: str | None = None) -> None:
+        path = path or cache_path(LEXICON_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path + ".tmp", mode="w", encoding="utf-8") as out:
+            out.write(f"#last_id\t{self.last_id}\n")
+            out.writelines(f"{w}\t{n}\n" for w, n in zip(self.lexemes, self.weights))
+        os.replace(path + ".tmp", path)
+
+        logger.info("Saved %d lexemes to %s", len(self), path)
+
+    @staticmethod
+    def load(path: str | None = None) -> "Lexicon":
+        path = path or cache_path(LEXICON_FILE)
+
+        with open(path, mode="r", encoding="utf-8") as infile:
+            last_id = int(infile.readline().split("\t")[1])
+            counts = {}
+            for line in infile:
+                lexeme, n = line.rstrip("\n").split("\t")
+                counts[lexeme] = int(n)
+
+        return Lexicon(counts, last_id)
+
+
+# Loaded once per process, and again only after lexicon.tsv is rewritten, so
+# text_query.py doesn't rebuild it on every search
+def cached(path: str | None = None) -> Lexicon:
+    path = path or cache_path(LEXICON_FILE)
+    return _load(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _load(path: str, mtime: int) -> Lexicon:
+    return Lexicon.load(path)
+
+
+# Document frequency of every lexeme in docs with id > after_id
+def fetch_lexemes(connection, after_id: int = -1) -> Tuple[Dict[str, int], int]:
+    with connection.cursor() as cur:
+        cur.execute("SELECT coalesce(max(id), -1) FROM documents")
+        last_id = cur.fetchone()[0]
+        cur.execute(
+            "SELECT word, ndoc FROM ts_stat(format('SELECT docvec FROM documents "
+            "WHERE id > %%s AND id <= %%s', %s::bigint, %s::bigint))",
+            (after_id, last_id),
+        )
+        counts = dict(cur.fetchall())
+
+    logger.info("Fetched %d lexemes from docs %d..%d", len(counts), after_id + 1, last_id)
+
+    return counts, last_id
+
+
+def build(connection) -> Lexicon:
+    counts, last_id = fetch_lexemes(connection)
+    lexicon = Lexicon(counts, last_id)
+    lexicon.save()
+    return lexicon
+
+
+# Rebuild from the saved lexicon plus the docs ingested since, or from
+# scratch when the ids went backwards because documents was reloaded
+def update(connection) -> Lexicon:
+    try:
+        lexicon = Lexicon.load()
+    except FileNotFoundError:
+        return build(connection)
+
+    with connection.cursor() as cur:
+        cur.execute("SELECT coalesce(max(id), -1) FROM documents")
+        max_id = cur.fetchone()[0]
+    if max_id < lexicon.last_id:
+        logger.info("documents ends at id %d, before %d, rebuilding", max_id, lexicon.last_id)
+        return build(connection)
+
+    counts, last_id = fetch_lexemes(connection, lexicon.last_id)
+    if counts:
+        lexicon.merge(counts, last_id)
+        lexicon.save()
+
+    return lexicon
+
+
+# Terms of a query that no indexed lexeme starts with, with alternatives
+def missing_terms(
+    lexicon: Lexicon, words: Iterable[str], stem_len: int = 4, k: int = 5
+) -> Dict[str, List[str]]:
+
+    missing = {}
+    for word in words:
+        probe = strip_accents_and_lowercase(word)[:stem_len]
+        if probe and not lexicon.has_prefix(probe):
+            missing[word] = [w for w, _ in lexicon.complete(probe[:-1], k)]
+
+    return missing
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        format="[%(levelname)-7s] %(asctime)s: %(message)s",
+        datefmt="%d/%m/%Y %H:%M:%S",
+        level=logging.INFO,
+    )
+
+    assert len(sys.argv) > 1, "Not enough arguments: build | update | complete <prefix> [k]"
+
+    if sys.argv[1] == "complete":
+        for lexeme, ndoc in Lexicon.load().complete(
+            sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        ):
+            print(f"{lexeme:<30} {ndoc}")
+    else:
+        from text_query import initialize_conn, read_from_config
+
+        with initialize_conn(read_from_config("postgre.ini")) as conn:
+            build(conn) if sys.argv[1] == "build" else update(conn)
@@ -1,22 +1,29 @@
+from __future__ import annotations
+
+import csv
 import logging
 import os
 import re
 import unicodedata
 import sys
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from configparser import ConfigParser
+from datetime import datetime
 from pathlib import PurePath
 from types import NoneType
-from typing import Dict, List, NamedTuple
-
-import numpy as np
-import psycopg
-from greek_stemmer.stemmer import stem_word
-from nltk.corpus import stopwords
-from psycopg import sql
-from psycopg.rows import namedtuple_row
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Tuple
 
+from query_parser import parse, positive_terms, to_tsquery_text
+from search_backend import MAX_RESULTS
 from utils.call_grep import execute_cmd
+from utils.lexicon import is_stopword, stem
+from utils.metrics import incr, span, timed
+from utils.sites import site_host
+
+# psycopg takes ~100 ms to import, so the Postgres paths import it themselves
+if TYPE_CHECKING:
+    import psycopg
+    from psycopg import sql
 
 logging.basicConfig(
     format="[%(levelname)-7s] %(asctime)s: %(message)s",
@@ -26,7 +33,6 @@ logging.basicConfig(
 
 logger = logging.getLogger()
 
-MAX_RESULTS = 100
 # Define all the valid PostgreSQL dist. metrics
 VALID_METRICS = {
     "no_doc_length": 0,
@@ -51,8 +57,10 @@ class bcolors:
     UNDERLINE = "\033[4m"
 
 
-# Reads database connection info from a .ini file
-def read_from_config(conf_file: str) -> Dict[str, str] | NoneType:
+# Reads database connection info from a section of a .ini file
+def read_from_config(
+    conf_file: str, section: str = "credentials"
+) -> Dict[str, str] | NoneType:
 
     config = ConfigParser(allow_no_value=False)
 
@@ -64,21 +72,21 @@ def read_from_config(conf_file: str) -> Dict[str, str] | NoneType:
 
     db_conn = defaultdict()
 
-    if config.has_section("credentials"):
-        if config.has_option("credentials", "user"):
-            db_conn["user"] = config.get("credentials", "user")
+    if config.has_section(section):
+        if config.has_option(section, "user"):
+            db_conn["user"] = config.get(section, "user")
             logger.info("Using username [%s]", db_conn["user"])
-        if config.has_option("credentials", "password"):
-            db_conn["password"] = config.get("credentials", "password")
+        if config.has_option(section, "password"):
+            db_conn["password"] = config.get(section, "password")
             logger.info("Using password [%s]", "*" * 6)
-        if config.has_option("credentials", "host"):
-            db_conn["host"] = config.get("credentials", "host")
+        if config.has_option(section, "host"):
+            db_conn["host"] = config.get(section, "host")
             logger.info("Using host [%s]", db_conn["host"])
-        if config.has_option("credentials", "port"):
-            db_conn["port"] = config.get("credentials", "port")
+        if config.has_option(section, "port"):
+            db_conn["port"] = config.get(section, "port")
             logger.info("Using port [%s]", db_conn["port"])
-        if config.has_option("credentials", "dbname"):
-            db_conn["dbname"] = config.get("credentials", "dbname")
+        if config.has_option(section, "dbname"):
+            db_conn["dbname"] = config.get(section, "dbname")
             logger.info("Using database [%s]", db_conn["dbname"])
     else:
         raise RuntimeError("Configuration file missing parameters")
@@ -90,7 +98,9 @@ def read_from_config(conf_file: str) -> Dict[str, str] | NoneType:
 
 
 # Establish connection to database
+@timed("text_query.initialize_conn")
 def initialize_conn(conf_dict: Dict) -> psycopg.Connection:
+    import psycopg
 
     try:
         conn = psycopg.connect(**conf_dict)
@@ -101,24 +111,56 @@ def initialize_conn(conf_dict: Dict) -> psycopg.Connection:
         raise e
 
 
-# Prepare query with selected columns to project, metrics and keywords
-def prep_query(user_input: str, *columns: str, metric: int = 0) -> str:
-    
-    user_input = re.sub("\W", " ", user_input)
-    user_input = re.sub("\s\s+", " ", user_input)
+# Extra WHERE conditions on site and crawl time, e.g. " AND site = 'in.gr'"
+def filter_conditions(
+    site: str | NoneType = None,
+    since: str | NoneType = None,
+    until: str | NoneType = None,
+) -> sql.Composed:
+    from psycopg import sql
+
+    conditions = []
+    if site:
+        conditions += [sql.SQL("site = {}").format(sql.Literal(site_host(site)))]
+    if since:
+        conditions += [
+            sql.SQL("time_crawled >= {}").format(sql.Literal(datetime.fromisoformat(since)))
+        ]
+    if until:
+        conditions += [
+            sql.SQL("time_crawled < {}").format(sql.Literal(datetime.fromisoformat(until)))
+        ]
+
+    return sql.Composed([sql.SQL(" AND ") + c for c in conditions])
+
+
+# Prepare query with selected columns to project, metrics, keywords and filters,
+# phrases, NEAR/N, OR and NOT are compiled to tsquery operators (see query_parser.py)
+def prep_query(user_input: str, *columns: str, metric: int = 0, **filters) -> sql.Composed:
+    from psycopg import sql
+
+    keywords = to_tsquery_text(user_input)
     
-    logger.info("User searched for [%s]", user_input)
+    logger.info("User searched for [%s] -> [%s]", user_input.strip(), keywords)
 
-    query = f"SELECT {','.join(columns)}, ts_rank_cd(docvec, query, {metric}) AS rank \
-    FROM documents, plainto_tsquery('greek', '{user_input.strip()}') query \
-    WHERE query @@ docvec \
+    query = sql.SQL(
+        "SELECT {}, ts_rank_cd(docvec, query, {}) AS rank \
+    FROM documents, to_tsquery('greek', {}) query \
+    WHERE query @@ docvec{} \
     ORDER BY rank DESC"
+    ).format(
+        sql.SQL(",").join(map(sql.Identifier, columns)),
+        sql.Literal(metric),
+        sql.Literal(keywords),
+        filter_conditions(**filters),
+    )
 
     logger.info("Constructed the query")
 
     return query
 
 
+@timed("text_query.execute_similarity_query")
 def execute_similarity_query(
     query: sql.SQL, connection: psycopg.Connection, max_res: int
 ) -> List[NamedTuple]:
@@ -129,6 +171,8 @@ def execute_similarity_query(
         connection (psycopg.Connection): connector
         max_res (int): top k most relevant
     """
+    from psycopg.rows import namedtuple_row
+
     if max_res > MAX_RESULTS:
         raise ValueError(
             f"Results set exceeds max number of instances to return {max_res} > {MAX_RESULTS}"
@@ -138,27 +182,157 @@ def execute_similarity_query(
 
     logger.info("Fetching at most %d instance(s)", max_res)
     with connection.cursor("conn", row_factory=namedtuple_row) as cur:
-        cur.execute(query)
-        for row in cur.fetchmany(max_res):
-            result_set += [row]
+        with span("text_query.execute"):
+            cur.execute(query)
+        with span("text_query.fetch"):
+            for row in cur.fetchmany(max_res):
+                result_set += [row]
+        incr("text_query.rows", len(result_set))
 
         
     return result_set
 
 
-def normalize_rank(results: List[NamedTuple]) -> List[NamedTuple]:
-    """Normalize ranks in range [0,1]"""
+# Ranked matches as a subquery, shared by the paginated and streaming queries
+def ranked_matches(*columns: str, **filters) -> sql.Composed:
+    from psycopg import sql
 
-    def normalize(data: List[float]) -> List[float]:
-        return (data - np.min(data)) / (np.max(data) - np.min(data))\
-            if any(np.diff(data)) else data
-    
-    norm_ranks = normalize([row.rank for row in results])
+    return sql.SQL(
+        "SELECT {}, ts_rank_cd(docvec, query, %(metric)s) AS rank \
+        FROM documents, to_tsquery('greek', %(keywords)s) query \
+        WHERE query @@ docvec{}"
+    ).format(
+        sql.SQL(", ").join(map(sql.Identifier, (*columns, "id"))),
+        filter_conditions(**filters),
+    )
+
+
+def prep_params(user_input: str, metric: int = 0, **params) -> Dict:
+    return dict(keywords=to_tsquery_text(user_input), metric=metric, **params)
+
+
+@timed("text_query.fetch_page")
+def fetch_page(
+    user_input: str,
+    connection: psycopg.Connection,
+    *columns: str,
+    metric: int = 0,
+    page_size: int = MAX_RESULTS,
+    after: Tuple[float, int] | NoneType = None,
+    **filters,
+) -> List[NamedTuple]:
+    """Return the page of results that follows the (rank, id) key `after`
+
+    Keyset pagination: the page is located with a WHERE clause on the last
+    (rank, id) seen instead of an OFFSET, so page N costs the same as page 1.
+
+    Args:
+        user_input (str): keywords
+        connection (psycopg.Connection): connector
+        page_size (int): rows per page
+        after (Tuple[float, int]): (rank, id) of the last row of the previous page
+        filters: site, since and until, see filter_conditions
+    """
+    from psycopg import sql
+    from psycopg.rows import namedtuple_row
+
+    keyset = (
+        sql.SQL("WHERE rank < %(rank)s::real OR (rank = %(rank)s::real AND id > %(id)s)")
+        if after is not None
+        else sql.SQL("")
+    )
+    query = sql.SQL(
+        "SELECT * FROM ({}) ranked {} ORDER BY rank DESC, id ASC LIMIT %(limit)s"
+    ).format(ranked_matches(*columns, **filters), keyset)
+
+    rank, id_ = after if after is not None else (None, None)
+    params = prep_params(user_input, metric, rank=rank, id=id_, limit=page_size)
+
+    with connection.cursor(row_factory=namedtuple_row) as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+
+# Yield consecutive pages until the result set is exhausted
+def iter_pages(
+    user_input: str, connection: psycopg.Connection, *columns: str, **kwargs
+) -> Iterator[List[NamedTuple]]:
+
+    after = None
+    while True:
+        page = fetch_page(user_input, connection, *columns, after=after, **kwargs)
+        if not page:
+            return
+        yield page
+        after = (page[-1].rank, page[-1].id)
+
+
+# Stream every match through a server-side cursor in fixed size batches
+def stream_results(
+    user_input: str,
+    connection: psycopg.Connection,
+    *columns: str,
+    metric: int = 0,
+    batch_size: int = 2000,
+    **filters,
+) -> Iterator[NamedTuple]:
+    from psycopg import sql
+    from psycopg.rows import namedtuple_row
+
+    query = sql.SQL("{} ORDER BY rank DESC, id ASC").format(
+        ranked_matches(*columns, **filters)
+    )
+
+    with connection.cursor("stream", row_factory=namedtuple_row) as cur:
+        cur.itersize = batch_size
+        cur.execute(query, prep_params(user_input, metric))
+        yield from cur
+
+
+# (min, max) rank over the whole result set, used to scale pages consistently
+@timed("text_query.rank_bounds")
+def rank_bounds(
+    user_input: str, connection: psycopg.Connection, metric: int = 0, **filters
+) -> Tuple[float, float]:
+    from psycopg import sql
+
+    query = sql.SQL("SELECT min(rank), max(rank) FROM ({}) ranked").format(
+        ranked_matches(**filters)
+    )
+
+    with connection.cursor() as cur:
+        cur.execute(query, prep_params(user_input, metric))
+        return cur.fetchone()
+
+
+def scale_rank(
+    rows: Iterable[NamedTuple], bounds: Tuple[float, float]
+) -> Iterator[NamedTuple]:
+    """Min-max scale the rank of each row lazily, given global (min, max)"""
+    lo, hi = bounds
+    span = hi - lo if hi is not None and lo is not None else 0
+
+    for row in rows:
+        yield row._replace(rank=(row.rank - lo) / span) if span else row
+
+
+@timed("text_query.normalize_rank")
+def normalize_rank(
+    results: List[NamedTuple], bounds: Tuple[float, float] | NoneType = None
+) -> List[NamedTuple]:
+    """Normalize ranks in range [0,1]
+
+    Args:
+        results (List[NamedTuple]): rows with a rank field
+        bounds (Tuple[float, float]): global (min, max) as returned by rank_bounds,
+            defaults to the bounds of results itself
+    """
+    if bounds is not None:
+        return list(scale_rank(results, bounds))
+
+    ranks = [row.rank for row in results]
+    scaled_results = list(scale_rank(results, (min(ranks), max(ranks)))) if ranks else []
     logger.info("Scaled ranks in range (0,1)")
-    scaled_results: List[NamedTuple] = []
-    for i, row in enumerate(results):
-        copy_Row = row._replace(rank=norm_ranks[i])
-        scaled_results += [copy_Row]
 
     return scaled_results
 
@@ -180,16 +354,17 @@ def display_results(results: List[NamedTuple]) -> None:
         logger.warning("Got an empty list, nothing to display")
 
 
+@timed("text_query.display_matching_line")
 def display_matching_line(
     query: str, filename: str, lang: str = "greek", cutoff: int = 5
 ) -> NoneType:
 
-    query = [word for word in query.split() if word not in stopwords.words(lang)]
+    query = [word for word in query.split() if not is_stopword(word, lang)]
     keywords = list()
 
     for word in query:
         if len(word) >= cutoff:
-            keywords += [stem_word(word, "NNM").lower() + "*"]
+            keywords += [stem(word) + "*"]
         else:
             keywords += [word.lower()]
     
@@ -203,10 +378,10 @@ def display_matching_line(
         for row in matching_lines:
             line = []
             for word in row.value.replace(".", " ").split():
-                if stem_word(word, "NNM").lower() in keywords or word in keywords:
+                if stem(word) in keywords or word in keywords:
                     line += [color_word(word)]
                 elif any(
-                    stem_word(word, "NNM").lower().__len__() >= len(w)
+                    stem(word).__len__() >= len(w)
                     for w in keywords
                     if len(w) >= cutoff
                 ) and any(word.find(k) != -1 for k in keywords):
@@ -261,11 +436,123 @@ def display_matching_lines(
         logger.info("Skipping the display of matching lines")
 
 
+# Fetch the projected columns of the docs returned by the vector index
+def fetch_similar_docs(
+    hits: List[tuple], connection: psycopg.Connection, *columns: str
+) -> List[NamedTuple]:
+    from psycopg import sql
+    from psycopg.rows import namedtuple_row
+
+    scores = dict(hits)
+    query = sql.SQL("SELECT id, {} FROM documents WHERE id = ANY(%s)").format(
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+
+    with connection.cursor(row_factory=namedtuple_row) as cur:
+        cur.execute(query, (list(scores),))
+        rows = cur.fetchall()
+
+    rows.sort(key=lambda row: scores[row.id], reverse=True)
+
+    Row = namedtuple("Row", (*columns, "rank"))
+    return [Row(*(getattr(row, c) for c in columns), scores[row.id]) for row in rows]
+
+
+# Write every match to a CSV file, memory use doesn't depend on the no. of hits
+@timed("text_query.export_results")
+def export_results(
+    user_input: str,
+    connection: psycopg.Connection,
+    outfile: str,
+    *columns: str,
+    metric: int = 0,
+    **filters,
+) -> int:
+
+    bounds = rank_bounds(user_input, connection, metric, **filters)
+    n_rows = 0
+
+    with open(outfile, mode="w", encoding="utf-8", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow((*columns, "id", "rank"))
+        for row in scale_rank(
+            stream_results(user_input, connection, *columns, metric=metric, **filters),
+            bounds,
+        ):
+            writer.writerow(row)
+            n_rows += 1
+
+    logger.info("Exported %d results to %s", n_rows, os.path.abspath(outfile))
+
+    return n_rows
+
+
 # Return no. of relevant docs if they rank above threshold
 def find_relevant(results: List[NamedTuple], threshold: float = 0.5) -> int:
     return sum(1 for i in results if i.rank >= threshold)
 
 
+# Fix typos and missing accents against the corpus vocabulary (see fuzzy.py)
+@timed("text_query.correct_query")
+def correct_query(user_input: str) -> str:
+    import fuzzy
+
+    try:
+        index = fuzzy.cached()
+    except FileNotFoundError:
+        return user_input
+
+    corrected, changes = index.correct(user_input, keep=("AND", "OR", "NOT", "NEAR"))
+    for old, new in changes.items():
+        logger.info("Corrected [%s] -> [%s]", old, new)
+
+    return corrected
+
+
+# Warn about query terms that can't match anything, before hitting the DB
+def suggest_terms(user_input: str) -> NoneType:
+    import suggest
+
+    try:
+        lexicon = suggest.cached()
+    except FileNotFoundError:
+        return
+
+    words = [w for w in positive_terms(parse(user_input)) if not is_stopword(w)]
+    for word, alternatives in suggest.missing_terms(lexicon, words).items():
+        logger.warning(
+            "No indexed term starts like [%s], did you mean: %s",
+            word,
+            ", ".join(alternatives) if alternatives else "-",
+        )
+
+
+# Remove --<name> <value> from argv and return the value
+def pop_option(argv: List[str], name: str) -> str | NoneType:
+    if f"--{name}" not in argv:
+        return None
+
+    i = argv.index(f"--{name}")
+    assert i + 1 < len(argv), f"Missing value for --{name}"
+    value = argv.pop(i + 1)
+    argv.pop(i)
+
+    return value
+
+
+# Remove --site/--since/--until <value> from argv and return them
+def pop_filters(argv: List[str]) -> Dict[str, str]:
+    filters = {}
+    for name in ("site", "since", "until"):
+        if (value := pop_option(argv, name)) is not None:
+            filters[name] = value
+
+    if filters:
+        logger.info("Filtering results by %s", filters)
+
+    return filters
+
+
 def validate_metric(metric: str, default: str = "no_doc_length") -> int:
     if metric in VALID_METRICS.keys():
         logger.info("Metric chosen [%s]", metric)
@@ -281,15 +568,73 @@ def validate_metric(metric: str, default: str = "no_doc_length") -> int:
 
 if __name__ == "__main__":
     
+    # Prefix completions are served locally: --complete <prefix> [k]
+    if len(sys.argv) > 2 and sys.argv[1] == "--complete":
+        from suggest import Lexicon
+
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        for lexeme, ndoc in Lexicon.load().complete(sys.argv[2], k):
+            print(f"{lexeme:<30} {ndoc}")
+
+        sys.exit(0)
+
+    # Optional on any search: --site <in.gr> --since <YYYY-MM-DD> --until <YYYY-MM-DD>
+    filters = pop_filters(sys.argv)
+
+    # --backend postgres (default) | sqlite[:<path>] | index[:<dir>], see search_backend.py
+    from search_backend import PostgresBackend, open_backend
+
     '''
     In case the .ini file is saved under a different name
     this must be explicitly defined inside the argument below
     '''
-    config = read_from_config("postgre.ini")
+    backend = open_backend(pop_option(sys.argv, "backend") or "postgres", "postgre.ini")
 
-    connection = initialize_conn(config)
+    connection = backend.connection
 
-    assert len(sys.argv) > 2, "Not enough arguments: <query> <metric> <max_res>"
+    assert len(sys.argv) > 2, (
+        "Not enough arguments: <query> <metric> <max_res> [--backend postgres|sqlite|index] | "
+        "--similar <doc_id> <max_res> | --export <query> <metric> <outfile.csv> | "
+        "--complete <prefix> [k]"
+    )
+
+    if sys.argv[1] in ("--export", "--similar"):
+        assert isinstance(backend, PostgresBackend), f"{sys.argv[1]} needs the postgres backend"
+
+    # Export the whole result set: --export <query> <metric> <outfile.csv>
+    if sys.argv[1] == "--export":
+        try:
+            export_results(
+                sys.argv[2],
+                connection,
+                sys.argv[4],
+                "title",
+                "filepath",
+                metric=validate_metric(sys.argv[3]),
+                **filters,
+            )
+        finally:
+            connection.close()
+            logger.info("Connection to database closed")
+
+        sys.exit(0)
+
+    # "More like this" mode, served from the index built by vector_index.py
+    if sys.argv[1] == "--similar":
+        from vector_index import DEFAULT_INDEX_DIR, VectorIndex
+
+        doc_id, max_res = int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+        try:
+            hits = VectorIndex(DEFAULT_INDEX_DIR).similar_to(doc_id, k=max_res)
+            display_results(fetch_similar_docs(hits, connection, "title", "filepath"))
+        except KeyError as e:
+            logger.error(e)
+        finally:
+            connection.close()
+            logger.info("Connection to database closed")
+
+        sys.exit(0)
 
     query, metric, max_res = sys.argv[1], sys.argv[2], sys.argv[3]
 
@@ -297,6 +642,9 @@ if __name__ == "__main__":
 
     metric_ = validate_metric(metric)
 
+    query = query_str = correct_query(query)
+    suggest_terms(query)
+
     cols_to_display = ("title", "filepath")
     '''
     Uncomment line below to show the vector holding the data aswell.
@@ -306,10 +654,10 @@ if __name__ == "__main__":
     
     logger.info(f"Showing cols {*cols_to_display,}")
 
-    query = prep_query(query, *cols_to_display, metric=metric_)
-    
     try:    
-        results = execute_similarity_query(query, connection, int(max_res))
+        results = backend.search(
+            query, *cols_to_display, k=int(max_res), metric=metric_, **filters
+        )
         scaled_results = normalize_rank(results)
         
         # Setting the threshold for relevant docs to 0.5 and above        
@@ -324,12 +672,11 @@ if __name__ == "__main__":
             )
 
         display_results(scaled_results)
-        display_matching_lines(scaled_results, query_str, thres)
+        display_matching_lines(scaled_results, " ".join(positive_terms(parse(query_str))), thres)
     
-    except (ValueError, AssertionError):
-        logger.error("Got 0 results!")
+    except (ValueError, AssertionError) as e:
+        logger.error("Got 0 results! %s", e)
             
 
     finally:    
-        connection.close()
-        logger.info("Connection to database closed")
+        backend.close()
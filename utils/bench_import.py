@@ -0,0 +1,87 @@
+import logging
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+logging.basicConfig(
+    format="[%(levelname)s] %(asctime)s : %(message)s",
+    datefmt="%d/%m/%Y %I:%M:%S %p",
+    level="INFO",
+)
+logger = logging.getLogger()
+
+# Modules a plain keyword search must not import
+FORBIDDEN = ("numpy", "nltk", "greek_stemmer", "pandas", "tabulate", "psycopg")
+
+LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# Run `python -X importtime -c "import <module>"` and parse its stderr
+def import_times(module: str = "text_query") -> List[Tuple[str, int, int]]:
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root,
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    )
+
+    rows = [
+        (m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)))
+        for m in map(LINE_RE.match, output.stderr.splitlines())
+        if m
+    ]
+
+    # Keep only the subtree of `module`, nested imports are printed before it
+    end = max(i for i, row in enumerate(rows) if row[0] == module)
+    start = end
+    while start > 0 and rows[start - 1][3] > rows[end][3]:
+        start -= 1
+
+    # (module, self us, cumulative us)
+    return [row[:3] for row in rows[start : end + 1]]
+
+
+def check(module: str = "text_query", budget_ms: float = 100, repeat: int = 3) -> bool:
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        total = times[-1][2]
+        best = (total, times) if best is None or total < best[0] else best
+
+    total, times = best
+    logger.info("Importing %s takes %.1f ms (budget %.1f ms)", module, total / 1000, budget_ms)
+
+    for name, _, cum in sorted(times, key=lambda x: -x[2])[:10]:
+        logger.info("%10.1f ms  %s", cum / 1000, name)
+
+    ok = total / 1000 <= budget_ms
+
+    loaded = {name.split(".")[0] for name, _, _ in times}
+    for name in FORBIDDEN:
+        if name in loaded:
+            logger.error("%s is imported eagerly by %s", name, module)
+            ok = False
+
+    if not ok:
+        logger.error("Import time regression in %s", module)
+
+    return ok
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) <= 3, "Too many arguments: [module] [budget ms]"
+
+    sys.exit(
+        0
+        if check(
+            sys.argv[1] if len(sys.argv) > 1 else "text_query",
+            float(sys.argv[2]) if len(sys.argv) > 2 else 100,
+        )
+        else 1
+    )
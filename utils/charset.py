@@ -0,0 +1,83 @@
+"""Cheap charset detection for downloaded pages
+
+Response.text falls back to statistical detection over the whole body when
+the server sends no charset. Instead the crawler keeps the raw bytes and the
+encoding found in the Content-Type header, a BOM or a <meta> tag within the
+first few KB, and the extractor decodes each page exactly once.
+"""
+import codecs
+import csv
+import os
+import re
+from typing import Dict
+
+SNIFF_BYTES = 4096
+DEFAULT_ENCODING = "utf-8"
+
+HEADER_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.I)
+META_RE = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)", re.I)
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def normalize_encoding(name: str | None) -> str | None:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
+
+
+# Header charset, then BOM, then <meta> in the first SNIFF_BYTES, then utf-8
+def sniff_encoding(raw: bytes, content_type: str | None = None) -> str:
+    if content_type:
+        m = HEADER_RE.search(content_type)
+        if m and normalize_encoding(m.group(1)):
+            return normalize_encoding(m.group(1))
+
+    for bom, name in BOMS:
+        if raw.startswith(bom):
+            return name
+
+    m = META_RE.search(raw[:SNIFF_BYTES])
+    if m and normalize_encoding(m.group(1).decode("ascii", "ignore")):
+        return normalize_encoding(m.group(1).decode("ascii"))
+
+    return DEFAULT_ENCODING
+
+
+# Without a recorded encoding the page predates the encodings sidecar, and the
+# old crawler always wrote utf-8 whatever its <meta charset> says
+def decode(raw: bytes, encoding: str | None = None) -> str:
+    return raw.decode(encoding or DEFAULT_ENCODING, errors="replace")
+
+
+# Encodings of the pages in html_dir live next to it, not inside it, since
+# the crawler numbers new pages by the no. of files already in the directory
+def encodings_path(html_dir: str) -> str:
+    return os.path.abspath(html_dir).rstrip(os.sep) + "_encodings.csv"
+
+
+def append_encodings(html_dir: str, encodings: Dict[str, str]) -> None:
+    path = encodings_path(html_dir)
+    new = not os.path.isfile(path)
+
+    with open(path, mode="a", encoding="utf-8", newline="") as out:
+        writer = csv.writer(out)
+        if new:
+            writer.writerow(("file", "encoding"))
+        writer.writerows(encodings.items())
+
+
+def read_encodings(html_dir: str) -> Dict[str, str]:
+    try:
+        with open(encodings_path(html_dir), mode="r", encoding="utf-8") as infile:
+            reader = csv.reader(infile)
+            next(reader, None)
+            return {fname: enc for fname, enc in reader}
+    except FileNotFoundError:
+        return {}
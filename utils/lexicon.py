@@ -0,0 +1,111 @@
+"""Accent folding, stopwords and stems without importing nltk/greek_stemmer up front
+
+The normalised stopword set and every stem computed so far are kept in small
+cache files under ATD_CACHE_DIR (default: .cache/ at the repo root), so a
+warm CLI search never loads the NLTK corpus or the stemmer.
+"""
+import atexit
+import json
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Dict, FrozenSet
+
+CACHE_DIR = os.environ.get(
+    "ATD_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache")
+)
+
+_stems: Dict[str, str] | None = None
+_stems_dirty = False
+
+
+# Remove accents and lowercase each token
+def strip_accents_and_lowercase(s: str) -> str:
+    return "".join(
+        c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn"
+    ).lower()
+
+
+def cache_path(name: str) -> str:
+    return os.path.join(CACHE_DIR, name)
+
+
+def _write_cache(name: str, content: str) -> None:
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = cache_path(name + ".tmp")
+        with open(tmp, mode="w", encoding="utf-8") as out:
+            out.write(content)
+        os.replace(tmp, cache_path(name))
+    except OSError:
+        pass
+
+
+# Lowercased stopwords plus their accent-stripped forms, one per line on disk
+@lru_cache(maxsize=None)
+def stopword_set(lang: str = "greek") -> FrozenSet[str]:
+    fname = f"stopwords-{lang}.txt"
+
+    try:
+        with open(cache_path(fname), mode="r", encoding="utf-8") as infile:
+            return frozenset(infile.read().split("\n"))
+    except FileNotFoundError:
+        pass
+
+    from nltk.corpus import stopwords
+
+    words = {w.lower() for w in stopwords.words(lang)}
+    words |= {strip_accents_and_lowercase(w) for w in words}
+    _write_cache(fname, "\n".join(sorted(words)))
+
+    return frozenset(words)
+
+
+def is_stopword(word: str, lang: str = "greek") -> bool:
+    return word.lower() in stopword_set(lang)
+
+
+def _save_stems() -> None:
+    if _stems_dirty:
+        _write_cache("stems.json", json.dumps(_stems, ensure_ascii=False, separators=(",", ":")))
+
+
+def _load_stems() -> Dict[str, str]:
+    global _stems
+
+    if _stems is None:
+        try:
+            with open(cache_path("stems.json"), mode="r", encoding="utf-8") as infile:
+                _stems = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            _stems = {}
+        atexit.register(_save_stems)
+
+    return _stems
+
+
+# Lowercased greek_stemmer stem, the stemmer is only imported on a cache miss.
+# Bulk jobs such as index builds pass persist=False: they'd fill stems.json
+# with the whole corpus vocabulary, which every search then has to load
+def stem(word: str, pos: str = "NNM", persist: bool = True) -> str:
+    global _stems_dirty
+
+    stems = _load_stems()
+    key = f"{pos}:{word}"
+
+    if key in stems:
+        return stems[key]
+    if not persist:
+        return _stem_transient(word, pos)
+
+    stems[key] = _stem_transient(word, pos)
+    _stems_dirty = True
+
+    return stems[key]
+
+
+@lru_cache(maxsize=1 << 16)
+def _stem_transient(word: str, pos: str) -> str:
+    from greek_stemmer.stemmer import stem_word
+
+    return stem_word(word, pos).lower()
@@ -0,0 +1,173 @@
+"""Lightweight timing spans and counters shared by every pipeline stage
+
+Collection is off unless the ATD_METRICS environment variable names an output
+file (.json or .prom for Prometheus text format), e.g.
+
+    $ ATD_METRICS=run.json python crawler.py csv_files/links.csv raw_html
+    $ ATD_PROFILE=crawler.pstats python crawler.py csv_files/links.csv raw_html
+
+While disabled, a decorated call costs one global flag check and `span`
+returns a shared no-op context manager. ATD_PROFILE dumps cProfile stats of
+the whole run; no hooks are needed for sampling profilers such as py-spy.
+"""
+import atexit
+import cProfile
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict
+
+_enabled = False
+_lock = threading.Lock()
+_spans: Dict[str, Dict[str, float]] = {}
+_counters: Dict[str, float] = {}
+_noop = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(outfile: str | None = None) -> None:
+    global _enabled
+    _enabled = True
+
+    if outfile:
+        atexit.register(write_metrics, outfile)
+
+
+def record(name: str, seconds: float) -> None:
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = dict(count=1, total=seconds, min=seconds, max=seconds)
+        else:
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["min"] = min(stats["min"], seconds)
+            stats["max"] = max(stats["max"], seconds)
+
+
+def incr(name: str, value: float = 1) -> None:
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Time a block of code: `with span("extract.parse"): ...`
+def span(name: str):
+    return _Span(name) if _enabled else _noop
+
+
+# Time every call of a (sync or async) function under `name`
+def timed(name: str | None = None) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record(label, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot() -> Dict:
+    with _lock:
+        return dict(
+            argv=sys.argv,
+            spans={k: dict(v) for k, v in _spans.items()},
+            counters=dict(_counters),
+        )
+
+
+def to_prometheus(snap: Dict) -> str:
+    def label(name: str) -> str:
+        return re.sub(r"[^a-zA-Z0-9_.:-]", "_", name)
+
+    lines = [
+        "# TYPE atd_span_seconds summary",
+    ]
+    for name, stats in snap["spans"].items():
+        lines += [
+            f'atd_span_seconds_sum{{span="{label(name)}"}} {stats["total"]:.6f}',
+            f'atd_span_seconds_count{{span="{label(name)}"}} {stats["count"]}',
+            f'atd_span_seconds_max{{span="{label(name)}"}} {stats["max"]:.6f}',
+        ]
+
+    lines += ["# TYPE atd_events_total counter"]
+    for name, value in snap["counters"].items():
+        lines += [f'atd_events_total{{counter="{label(name)}"}} {value}']
+
+    return "\n".join(lines) + "\n"
+
+
+# Dump the collected metrics, Prometheus text if the file ends in .prom
+def write_metrics(outfile: str) -> None:
+    snap = snapshot()
+
+    with open(outfile, mode="w", encoding="utf-8") as out:
+        if outfile.endswith(".prom"):
+            out.write(to_prometheus(snap))
+        else:
+            json.dump(snap, out, indent=2, ensure_ascii=False)
+
+
+def _start_profiler(outfile: str) -> None:
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(outfile)
+
+    atexit.register(dump)
+
+
+if os.environ.get("ATD_METRICS"):
+    enable(os.environ["ATD_METRICS"])
+
+if os.environ.get("ATD_PROFILE"):
+    _start_profiler(os.environ["ATD_PROFILE"])
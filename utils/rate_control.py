@@ -0,0 +1,317 @@
+"""Per-host AIMD concurrency control for fetching pages
+
+Every host starts with a couple of requests in flight. Each healthy response
+(2xx after redirects, or a 4xx, with latency within `latency_factor` x the
+best smoothed latency seen) adds 1/limit to the host's limit, so the limit
+grows by about one request per round trip. A 429, a 5xx, a timeout or a
+connection error halves it, at most once per smoothed round trip so one
+burst of errors counts once. Those requests are retried after a jittered
+exponential delay (or the server's Retry-After), and urls that still fail
+are appended to a CSV failure log.
+
+The request timeout is per host too: `timeout_factor` x the smoothed
+latency within [min_timeout, max_timeout], doubled after every timeout so
+a slow but working site isn't cut off.
+"""
+import csv
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from utils.metrics import incr, span
+
+logger = logging.getLogger()
+
+OK, RETRY, FAIL = "ok", "retry", "fail"
+
+
+@dataclass
+class HostState:
+    limit: float
+    in_flight: int = 0
+    latency: float | None = None
+    baseline: float | None = None
+    last_decrease: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    peak: float = 0.0
+    timeout: float = 5.0
+
+
+class RateController:
+    def __init__(
+        self,
+        initial: float = 2,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        latency_factor: float = 2.0,
+        alpha: float = 0.2,
+        initial_timeout: float = 5.0,
+        min_timeout: float = 2.0,
+        max_timeout: float = 30.0,
+        timeout_factor: float = 4.0,
+    ):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.alpha = alpha
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.hosts: Dict[str, HostState] = {}
+        self.cond = threading.Condition()
+
+    def state(self, host: str) -> HostState:
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.initial, peak=self.initial, timeout=self.initial_timeout)
+        return self.hosts[host]
+
+    def timeout(self, host: str) -> float:
+        with self.cond:
+            return self.state(host).timeout
+
+    def try_acquire(self, host: str) -> bool:
+        with self.cond:
+            state = self.state(host)
+            if state.in_flight >= int(state.limit):
+                return False
+            state.in_flight += 1
+            return True
+
+    def acquire(self, host: str) -> None:
+        with self.cond:
+            state = self.state(host)
+            while state.in_flight >= int(state.limit):
+                self.cond.wait()
+            state.in_flight += 1
+
+    def release(self, host: str, latency: float, outcome: str, timed_out: bool = False) -> None:
+        with self.cond:
+            state = self.state(host)
+            state.in_flight -= 1
+            state.requests += 1
+
+            if timed_out:
+                state.timeout = min(self.max_timeout, state.timeout * 2)
+
+            if outcome == RETRY:
+                state.errors += 1
+                now = time.monotonic()
+                if now - state.last_decrease > (state.latency or 0.0):
+                    state.limit = max(self.min_limit, state.limit / 2)
+                    state.last_decrease = now
+                    logger.info("%s: backing off to %d in flight", host, state.limit)
+            else:
+                state.latency = (
+                    latency
+                    if state.latency is None
+                    else (1 - self.alpha) * state.latency + self.alpha * latency
+                )
+                state.baseline = min(state.baseline or state.latency, state.latency)
+                state.timeout = min(
+                    self.max_timeout, max(self.min_timeout, self.timeout_factor * state.latency)
+                )
+                if state.latency <= self.latency_factor * state.baseline:
+                    state.limit = min(self.max_limit, state.limit + 1 / state.limit)
+                    state.peak = max(state.peak, state.limit)
+
+            self.cond.notify_all()
+
+    def summary(self) -> List[Dict]:
+        with self.cond:
+            return [
+                dict(
+                    host=host,
+                    limit=int(s.limit),
+                    peak=int(s.peak),
+                    requests=s.requests,
+                    errors=s.errors,
+                    latency_ms=round((s.latency or 0) * 1000, 1),
+                    timeout_s=round(s.timeout, 1),
+                )
+                for host, s in self.hosts.items()
+            ]
+
+
+class FailureLog:
+    """Append-only CSV of urls that couldn't be fetched"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, url: str, reason: str, attempts: int) -> None:
+        with self.lock:
+            new = not os.path.isfile(self.path)
+            with open(self.path, mode="a", encoding="utf-8", newline="") as out:
+                writer = csv.writer(out)
+                if new:
+                    writer.writerow(("time", "url", "reason", "attempts"))
+                writer.writerow(
+                    (datetime.isoformat(datetime.now(), sep=" ", timespec="seconds"), url, reason, attempts)
+                )
+        incr("fetch.failures")
+
+
+# Redirects are followed, so a 3xx here is one that couldn't be (no Location)
+def classify(res: requests.Response | None, error: Exception | None) -> str:
+    if error is not None:
+        return RETRY if isinstance(error, (requests.Timeout, requests.ConnectionError)) else FAIL
+    if res.status_code == 429 or 500 <= res.status_code < 600:
+        return RETRY
+    return OK if 200 <= res.status_code < 300 else FAIL
+
+
+# Full-jitter exponential backoff, at least the server's Retry-After
+def retry_delay(attempt: int, res: requests.Response | None, base: float = 1.0, cap: float = 60.0) -> float:
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+
+    retry_after = res.headers.get("Retry-After") if res is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(cap, float(retry_after)))
+
+    return delay
+
+
+def reason(res: requests.Response | None, error: Exception | None) -> str:
+    return f"HTTP {res.status_code}" if error is None else type(error).__name__
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+# One request, the caller holds a slot for the url's host
+def attempt(
+    session: requests.Session, url: str, controller: RateController
+) -> Tuple[requests.Response | None, Exception | None, str]:
+
+    host = host_of(url)
+    res, error = None, None
+    start = time.perf_counter()
+    try:
+        with span("fetch.request"):
+            res = session.get(url, allow_redirects=True, timeout=controller.timeout(host))
+    except requests.RequestException as e:
+        error = e
+
+    outcome = classify(res, error)
+    controller.release(
+        host, time.perf_counter() - start, outcome, timed_out=isinstance(error, requests.Timeout)
+    )
+    if res is not None and res.history:
+        incr("fetch.redirects", len(res.history))
+    incr("fetch.requests")
+
+    return res, error, outcome
+
+
+# Fetch url from a worker thread, sleeping between retries (used by pipeline.py)
+def fetch(
+    session: requests.Session,
+    url: str,
+    controller: RateController,
+    failures: FailureLog | None = None,
+    max_attempts: int = 4,
+) -> requests.Response:
+
+    for n in range(max_attempts):
+        controller.acquire(host_of(url))
+        res, error, outcome = attempt(session, url, controller)
+
+        if outcome == OK:
+            return res
+        if outcome == RETRY and n + 1 < max_attempts:
+            incr("fetch.retries")
+            time.sleep(retry_delay(n, res))
+            continue
+        break
+
+    if failures is not None:
+        failures.write(url, reason(res, error), n + 1)
+    if error is not None:
+        raise error
+    raise requests.HTTPError(f"{reason(res, error)} for {url}", response=res)
+
+
+def fetch_all(
+    urls: List[str],
+    controller: RateController,
+    failures: FailureLog | None = None,
+    max_attempts: int = 4,
+    workers: int = 64,
+    on_done: Callable[[int, requests.Response | None], None] | None = None,
+) -> List[requests.Response | None]:
+    """Successful response for every url, in order (None if it failed)
+
+    Urls wait in one queue per host and are only submitted when their host
+    has a free slot, so a throttled host doesn't tie up the worker threads.
+    Retries wait in a heap keyed on when they're due.
+    """
+    results: List[requests.Response | None] = [None] * len(urls)
+    queues: Dict[str, deque] = {}
+    for i, url in enumerate(urls):
+        queues.setdefault(host_of(url), deque()).append((i, 0))
+
+    retries: List[Tuple[float, int, int]] = []
+    local = threading.local()
+
+    def run(i: int, n: int):
+        if not hasattr(local, "session"):
+            local.session = requests.session()
+        return (i, n, *attempt(local.session, urls[i], controller))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = set()
+
+        while running or retries or any(queues.values()):
+            now = time.monotonic()
+            while retries and retries[0][0] <= now:
+                _, i, n = heapq.heappop(retries)
+                queues[host_of(urls[i])].appendleft((i, n))
+
+            for host, queue in queues.items():
+                while queue and len(running) < workers and controller.try_acquire(host):
+                    running.add(pool.submit(run, *queue.popleft()))
+
+            if not running:
+                time.sleep(max(0.0, retries[0][0] - now) if retries else 0.01)
+                continue
+
+            done, running = wait(
+                running,
+                timeout=max(0.0, retries[0][0] - now) if retries else None,
+                return_when=FIRST_COMPLETED,
+            )
+
+            for future in done:
+                i, n, res, error, outcome = future.result()
+                results[i] = res if outcome == OK else None
+
+                if outcome == RETRY and n + 1 < max_attempts:
+                    incr("fetch.retries")
+                    heapq.heappush(retries, (time.monotonic() + retry_delay(n, res), i, n + 1))
+                    continue
+
+                if outcome != OK and failures is not None:
+                    failures.write(urls[i], reason(res, error), n + 1)
+                if on_done is not None:
+                    on_done(i, results[i])
+
+    for row in controller.summary():
+        logger.info("%s", row)
+
+    return results
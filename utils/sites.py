@@ -0,0 +1,22 @@
+import re
+
+VALID_SITES = (
+    "https://www.in.gr",
+    "https://www.zougla.gr",
+    "https://www.naftemporiki.gr",
+    "https://www.news247.gr",
+)
+
+# Hosts as stored in documents.site, e.g. "in.gr"
+SITE_HOSTS = tuple(re.sub(r"^https?://(www\.)?", "", s) for s in VALID_SITES)
+
+
+# Map "in.gr", "in", "https://www.in.gr/..." to the host stored in documents.site
+def site_host(name: str) -> str:
+    host = re.sub(r"^https?://(www\.)?", "", name.strip().lower()).split("/")[0]
+
+    for valid in SITE_HOSTS:
+        if host in (valid, valid.split(".")[0]):
+            return valid
+
+    raise ValueError(f"Unknown site {name}, expected one of {', '.join(SITE_HOSTS)}")
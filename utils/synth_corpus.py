@@ -0,0 +1,173 @@
+"""Synthetic Greek news corpus for scale tests
+
+Words are drawn from the unigram distribution of the shipped
+csv_files/outfile.csv, article lengths follow a log-normal fitted to it and
+every page is laid out so that the site's `Selector` in extract.py matches.
+Articles are dated over 2022 and crawled shortly after, so the monthly
+partitions and date filters see a realistic spread of time_crawled.
+
+    $ python utils/synth_corpus.py <outdir> <n_docs> [--no-html]
+
+writes <outdir>/links.csv, <outdir>/outfile.csv and <outdir>/raw_html/doc{i}.html
+"""
+import csv
+import logging
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from html import escape
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+# Repo root, so utils resolves both as python utils/synth_corpus.py and on import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.sites import VALID_SITES
+
+logging.basicConfig(
+    format="[%(levelname)s] %(asctime)s : %(message)s",
+    datefmt="%d/%m/%Y %I:%M:%S %p",
+    level="INFO",
+)
+logger = logging.getLogger()
+
+SEED_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "csv_files", "outfile.csv"
+)
+
+SITES = VALID_SITES
+# Share of each site in the shipped corpus
+SITE_WEIGHTS = (0.44, 0.14, 0.18, 0.24)
+
+
+def page_in(title: str, paragraphs: List[str]) -> str:
+    return (
+        f"<html><head><title>{title} in gr</title></head><body>"
+        '<div class="main-content"><div class="breadcrumb">Πολιτική</div>'
+        f"<div>{''.join(f'<p>{p}</p>' for p in paragraphs)}</div></div></body></html>"
+    )
+
+
+def page_zougla(title: str, paragraphs: List[str]) -> str:
+    filler = "".join("<div></div>" for _ in range(7))
+    return (
+        f"<html><head><title>{title}</title></head><body><div class='header'></div>"
+        '<div class="article-container"><div>'
+        f"{filler}<div>{''.join(f'<p>{p}</p>' for p in paragraphs)}</div>"
+        "</div></div></body></html>"
+    )
+
+
+def page_naftemporiki(title: str, paragraphs: List[str]) -> str:
+    return (
+        f"<html><head><title>{title}</title></head><body>"
+        f'<div id="leftPHArea_Div1"><div>{"".join(f"<p>{p}</p>" for p in paragraphs)}</div></div>'
+        "</body></html>"
+    )
+
+
+def page_news247(title: str, paragraphs: List[str]) -> str:
+    # extract.py drops the last paragraph (related links)
+    return (
+        f"<html><head><title>{title}</title></head><body>"
+        f'<div class="article-body__body">{"".join(f"<p>{p}</p>" for p in paragraphs)}'
+        "<p>Διαβάστε επίσης</p></div></body></html>"
+    )
+
+
+TEMPLATES = (page_in, page_zougla, page_naftemporiki, page_news247)
+
+
+class CorpusModel:
+    def __init__(self, seed_csv: str = SEED_CSV, seed: int = 0):
+        import pandas as pd
+
+        df = pd.read_csv(seed_csv, sep=",", encoding="utf-8", usecols=("title", "body", "length"))
+        counts = Counter(w for body in df.body.dropna() for w in body.replace(".", " ").split())
+
+        self.words = np.array(list(counts))
+        freqs = np.fromiter(counts.values(), dtype=np.float64)
+        self.cdf = np.cumsum(freqs / freqs.sum())
+
+        lengths = np.log(df.length.clip(lower=50))
+        self.len_mu, self.len_sigma = float(lengths.mean()), float(lengths.std())
+        self.mean_word = float(np.mean([len(w) + 1 for w in counts]))
+
+        self.rng = np.random.default_rng(seed)
+
+    def sentence(self, n_words: int) -> str:
+        idx = np.searchsorted(self.cdf, self.rng.random(n_words) * self.cdf[-1])
+        words = self.words[np.minimum(idx, len(self.words) - 1)]
+        return " ".join(words).capitalize() + "."
+
+    def article(self) -> Tuple[str, List[str]]:
+        n_chars = self.rng.lognormal(self.len_mu, self.len_sigma)
+        n_words = max(15, int(n_chars / self.mean_word))
+
+        title = self.sentence(int(self.rng.integers(6, 14)))[:-1]
+        paragraphs, left = [], n_words
+        while left > 0:
+            size = min(left, int(self.rng.integers(30, 90)))
+            sentences, used = [], 0
+            while used < size:
+                n = min(size - used, int(self.rng.integers(8, 25)))
+                sentences.append(self.sentence(n))
+                used += n
+            paragraphs.append(" ".join(sentences))
+            left -= size
+
+        return title, paragraphs
+
+
+def generate(
+    n_docs: int, seed: int = 0
+) -> Iterator[Tuple[int, int, str, str, List[str], datetime]]:
+    """Yield (id, site, url, title, paragraphs, time crawled) for n_docs synthetic
+    articles, published over 2022 and each crawled up to 3 hours later"""
+    model = CorpusModel(seed=seed)
+    sites = model.rng.choice(len(SITES), n_docs, p=SITE_WEIGHTS)
+    start = datetime(2022, 1, 1)
+
+    for i in range(n_docs):
+        title, paragraphs = model.article()
+        day = start + timedelta(minutes=int(i * 525600 / max(n_docs, 1)))
+        url = f"{SITES[sites[i]]}/{day:%Y/%m/%d}/politics/synthetic-{i}/"
+        crawled = day + timedelta(minutes=int(model.rng.integers(5, 180)))
+        yield i, int(sites[i]), url, title, paragraphs, crawled
+
+
+# Write links.csv, outfile.csv and optionally raw_html/doc{i}.html
+def write_corpus(outdir: str, n_docs: int, html: bool = True, seed: int = 0) -> None:
+    html_dir = os.path.join(outdir, "raw_html")
+    os.makedirs(html_dir if html else outdir, exist_ok=True)
+
+    with open(os.path.join(outdir, "links.csv"), mode="w", encoding="utf-8") as links, open(
+        os.path.join(outdir, "outfile.csv"), mode="w", encoding="utf-8"
+    ) as outfile:
+        links_w, out_w = csv.writer(links), csv.writer(outfile, quoting=csv.QUOTE_NONE)
+        links_w.writerow(("id", "url"))
+        out_w.writerow(("id", "title", "body", "length", "size_bytes", "url", "wall_time"))
+
+        for i, site, url, title, paragraphs, crawled in generate(n_docs, seed):
+            body = "".join(paragraphs)
+            crawled = datetime.isoformat(crawled, sep=" ", timespec="seconds")
+            links_w.writerow((i, url))
+            out_w.writerow((i, title, body, len(body), len(body.encode("utf-8")), url, crawled))
+
+            if html:
+                with open(os.path.join(html_dir, f"doc{i}.html"), mode="w", encoding="utf-8") as out:
+                    out.write(TEMPLATES[site](escape(title), [escape(p) for p in paragraphs]))
+
+            if i and not i % 10000:
+                logger.info("Generated %d/%d documents", i, n_docs)
+
+    logger.info("Wrote %d synthetic documents to %s", n_docs, os.path.abspath(outdir))
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) >= 3, "Not enough arguments: <outdir> <n_docs> [--no-html]"
+
+    write_corpus(sys.argv[1], int(sys.argv[2]), html="--no-html" not in sys.argv)
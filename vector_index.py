@@ -0,0 +1,457 @@
+import json
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+logging.basicConfig(
+    format="[%(levelname)-7s] %(asctime)s: %(message)s",
+    datefmt="%d/%m/%Y %H:%M:%S",
+    level=logging.INFO,
+)
+
+logger = logging.getLogger()
+
+TOKEN_RE = re.compile(r"\w{2,}")
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.json"
+# Dense TF-IDF rows take n_docs x vocabulary x 4 bytes on disk, past this use LSA
+MAX_TFIDF_BYTES = 4 * 2**30
+# Rows densified or copied into the memmap at a time, about 64 MB
+WRITE_BLOCK_BYTES = 2**26
+DEFAULT_INDEX_DIR = "vector_index"
+
+
+# Yield (doc id, text) for every preprocessed article{i}.txt in a directory
+def read_corpus(dirname: str) -> Iterator[Tuple[int, str]]:
+    assert os.path.isdir(dirname), f"No such directory {dirname}"
+
+    filenames = sorted(
+        (f for f in os.listdir(dirname) if f.startswith("article") and f.endswith(".txt")),
+        key=lambda x: int("".join(filter(str.isdigit, x))),
+    )
+
+    for fname in filenames:
+        with open(os.path.join(dirname, fname), mode="r", encoding="utf-8") as infile:
+            yield int("".join(filter(str.isdigit, fname))), infile.read()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class CSRMatrix:
+    """Minimal compressed sparse row matrix, enough for TF-IDF and randomized SVD"""
+
+    def __init__(self, data: np.ndarray, indices: np.ndarray, indptr: np.ndarray, ncols: int):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = (len(indptr) - 1, ncols)
+
+    def rows(self, start: int, stop: int) -> "CSRMatrix":
+        lo, hi = self.indptr[start], self.indptr[stop]
+        return CSRMatrix(
+            self.data[lo:hi],
+            self.indices[lo:hi],
+            self.indptr[start : stop + 1] - lo,
+            self.shape[1],
+        )
+
+    def dot(self, dense: np.ndarray, chunk: int = 4096) -> np.ndarray:
+        """X @ dense"""
+        out = np.zeros((self.shape[0], dense.shape[1]), dtype=np.float32)
+        for start in range(0, self.shape[0], chunk):
+            stop = min(start + chunk, self.shape[0])
+            block = self.rows(start, stop)
+            row_ids = np.repeat(np.arange(stop - start), np.diff(block.indptr))
+            np.add.at(out[start:stop], row_ids, block.data[:, None] * dense[block.indices])
+        return out
+
+    def tdot(self, dense: np.ndarray, chunk: int = 4096) -> np.ndarray:
+        """X.T @ dense"""
+        out = np.zeros((self.shape[1], dense.shape[1]), dtype=np.float32)
+        for start in range(0, self.shape[0], chunk):
+            stop = min(start + chunk, self.shape[0])
+            block = self.rows(start, stop)
+            row_ids = np.repeat(np.arange(start, stop), np.diff(block.indptr))
+            np.add.at(out, block.indices, block.data[:, None] * dense[row_ids])
+        return out
+
+    def todense(self) -> np.ndarray:
+        out = np.zeros(self.shape, dtype=np.float32)
+        row_ids = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        out[row_ids, self.indices] = self.data
+        return out
+
+
+# Build an L2 normalised TF-IDF matrix out of tokenized documents
+def tfidf(
+    docs: List[List[str]], min_df: int = 2, max_df: float = 0.5, max_features: int = 50000
+) -> Tuple[CSRMatrix, Dict[str, int]]:
+
+    n_docs = len(docs)
+    df = Counter()
+    for tokens in docs:
+        df.update(set(tokens))
+
+    candidates = [
+        (term, freq)
+        for term, freq in df.items()
+        if freq >= min_df and freq / max(n_docs, 1) <= max_df
+    ]
+    candidates.sort(key=lambda x: (-x[1], x[0]))
+    vocab = {term: i for i, (term, _) in enumerate(candidates[:max_features])}
+
+    idf = np.zeros(len(vocab), dtype=np.float32)
+    for term, i in vocab.items():
+        idf[i] = math.log((1 + n_docs) / (1 + df[term])) + 1
+
+    data, indices, indptr = [], [], [0]
+    for tokens in docs:
+        counts = Counter(t for t in tokens if t in vocab)
+        cols = np.fromiter((vocab[t] for t in counts), dtype=np.int32, count=len(counts))
+        vals = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        vals = (1 + np.log(vals)) * idf[cols] if len(vals) else vals
+        norm = np.linalg.norm(vals)
+        indices.append(cols)
+        data.append(vals / norm if norm else vals)
+        indptr.append(indptr[-1] + len(cols))
+
+    matrix = CSRMatrix(
+        np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+        np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+        np.asarray(indptr, dtype=np.int64),
+        len(vocab),
+    )
+
+    logger.info("Built TF-IDF matrix %dx%d with %d non-zeros", *matrix.shape, len(matrix.data))
+
+    return matrix, vocab
+
+
+# Truncated SVD (Halko et al. randomized range finder) for LSA embeddings
+def truncated_svd(
+    matrix: CSRMatrix, dims: int, oversample: int = 10, n_iter: int = 4, seed: int = 0
+) -> np.ndarray:
+
+    rng = np.random.default_rng(seed)
+    k = min(dims + oversample, *matrix.shape)
+
+    y = matrix.dot(rng.standard_normal((matrix.shape[1], k), dtype=np.float32))
+    q, _ = np.linalg.qr(y)
+    for _ in range(n_iter):
+        z, _ = np.linalg.qr(matrix.tdot(q))
+        q, _ = np.linalg.qr(matrix.dot(z))
+
+    b = matrix.tdot(q).T
+    u_b, s, _ = np.linalg.svd(b, full_matrices=False)
+    dims = min(dims, k)
+
+    logger.info("Computed %d LSA components", dims)
+
+    return (q @ u_b[:, :dims]) * s[:dims]
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+# Spherical k-means used as the IVF coarse quantiser
+def kmeans(
+    vectors: np.ndarray, nlist: int, n_iter: int = 10, sample: int = 100000, seed: int = 0
+) -> np.ndarray:
+
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    train = np.asarray(vectors[np.sort(rng.choice(n, min(sample, n), replace=False))])
+    nlist = min(nlist, len(train))
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                centroids[c] = train[rng.integers(len(train))]
+        centroids = l2_normalize(centroids)
+
+    return centroids.astype(np.float32)
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    assign = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], batch):
+        block = np.asarray(vectors[start : start + batch])
+        assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top k (indices, scores) sorted by descending score"""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class VectorIndex:
+    """Memory-mapped float32 matrix of unit vectors with optional IVF lists"""
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, META_FILE), mode="r", encoding="utf-8") as infile:
+            self.meta = json.load(infile)
+
+        self.index_dir = index_dir
+        self.vectors = np.memmap(
+            os.path.join(index_dir, VECTORS_FILE),
+            dtype=np.float32,
+            mode="r",
+            shape=(self.meta["n_docs"], self.meta["dim"]),
+        )
+        self.doc_ids = np.load(os.path.join(index_dir, "ids.npy"))
+        self.row_of = {int(d): i for i, d in enumerate(self.doc_ids)}
+
+        self.centroids = self.list_offsets = self.list_rows = None
+        if self.meta.get("nlist"):
+            self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            self.list_offsets = np.load(os.path.join(index_dir, "list_offsets.npy"))
+            self.list_rows = np.load(os.path.join(index_dir, "list_rows.npy"))
+
+        logger.info(
+            "Loaded vector index with %d docs of dim %d from %s",
+            self.meta["n_docs"],
+            self.meta["dim"],
+            os.path.abspath(index_dir),
+        )
+
+    def __len__(self) -> int:
+        return self.meta["n_docs"]
+
+    # Exhaustive cosine search, the matrix is scanned in fixed size row batches
+    def search(
+        self, queries: np.ndarray, k: int = 10, batch: int = 65536
+    ) -> Tuple[np.ndarray, np.ndarray]:
+
+        queries = np.atleast_2d(queries).astype(np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, len(self), batch):
+            scores = queries @ np.asarray(self.vectors[start : start + batch]).T
+            rows, vals = top_k(scores, k)
+            best_rows = np.hstack((best_rows, rows + start))
+            best_scores = np.hstack((best_scores, vals))
+            rows, best_scores = top_k(best_scores, k)
+            best_rows = np.take_along_axis(best_rows, rows, axis=1)
+
+        return best_rows, best_scores
+
+    # Sub-linear search that only scans the nprobe closest inverted lists
+    def search_ivf(
+        self, queries: np.ndarray, k: int = 10, nprobe: int = 8
+    ) -> Tuple[np.ndarray, np.ndarray]:
+
+        if self.centroids is None:
+            return self.search(queries, k)
+
+        queries = np.atleast_2d(queries).astype(np.float32)
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for qi, lists in enumerate(probes):
+            cand = np.concatenate(
+                [self.list_rows[self.list_offsets[c] : self.list_offsets[c + 1]] for c in lists]
+            )
+            if not len(cand):
+                continue
+            cand.sort()  # sequential access on the memmap
+            scores = np.asarray(self.vectors[cand]) @ queries[qi]
+            rows, vals = top_k(scores[None, :], k)
+            out_rows[qi, : rows.shape[1]] = cand[rows[0]]
+            out_scores[qi, : vals.shape[1]] = vals[0]
+
+        return out_rows, out_scores
+
+    # Top k docs most similar to an already indexed doc id
+    def similar_to(self, doc_id: int, k: int = 10, nprobe: int = 0) -> List[Tuple[int, float]]:
+        if doc_id not in self.row_of:
+            raise KeyError(f"Document {doc_id} is not in the vector index")
+
+        query = np.asarray(self.vectors[self.row_of[doc_id]])
+        rows, scores = (
+            self.search_ivf(query, k + 1, nprobe) if nprobe else self.search(query, k + 1)
+        )
+
+        return [
+            (int(self.doc_ids[r]), float(s))
+            for r, s in zip(rows[0], scores[0])
+            if r >= 0 and self.doc_ids[r] != doc_id
+        ][:k]
+
+
+# vectors is a dense array or a CSRMatrix, which is densified a block of rows
+# at a time so only the memmap ever holds the whole thing
+def write_index(
+    index_dir: str, vectors: "np.ndarray | CSRMatrix", doc_ids: np.ndarray, nlist: int = 0, **meta
+) -> None:
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    n, dim = vectors.shape
+    mm = np.memmap(
+        os.path.join(index_dir, VECTORS_FILE),
+        dtype=np.float32,
+        mode="w+",
+        shape=(n, dim),
+    )
+    batch = max(1, WRITE_BLOCK_BYTES // (4 * max(dim, 1)))
+    for start in range(0, n, batch):
+        stop = min(start + batch, n)
+        mm[start:stop] = (
+            vectors.rows(start, stop).todense() if isinstance(vectors, CSRMatrix) else vectors[start:stop]
+        )
+    mm.flush()
+
+    np.save(os.path.join(index_dir, "ids.npy"), np.asarray(doc_ids, dtype=np.int64))
+
+    if nlist:
+        nlist = build_ivf(index_dir, mm, nlist)
+    del mm
+
+    meta.update(n_docs=int(n), dim=int(dim), nlist=nlist)
+    with open(os.path.join(index_dir, META_FILE), mode="w", encoding="utf-8") as out:
+        json.dump(meta, out)
+
+    logger.info("Wrote vector index to %s", os.path.abspath(index_dir))
+
+
+# Returns the no. of lists, at most the no. of k-means training vectors
+def build_ivf(index_dir: str, vectors: np.ndarray, nlist: int) -> int:
+    centroids = kmeans(vectors, nlist)
+    nlist = len(centroids)
+    assign = assign_lists(vectors, centroids)
+    rows = np.argsort(assign, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist))))
+
+    np.save(os.path.join(index_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(index_dir, "list_rows.npy"), rows.astype(np.int64))
+    np.save(os.path.join(index_dir, "list_offsets.npy"), offsets.astype(np.int64))
+
+    logger.info("Built IVF quantiser with %d lists", nlist)
+
+    return nlist
+
+
+# Build TF-IDF (dims=0) or LSA embeddings from the articles directory
+def build_from_corpus(articles_dir: str, index_dir: str, dims: int = 128, nlist: int = 0) -> None:
+    doc_ids, docs = [], []
+    for doc_id, text in read_corpus(articles_dir):
+        doc_ids.append(doc_id)
+        docs.append(tokenize(text))
+
+    logger.info("Read %d articles from %s", len(docs), os.path.abspath(articles_dir))
+
+    matrix, vocab = tfidf(docs)
+    if dims:
+        vectors = l2_normalize(truncated_svd(matrix, dims)).astype(np.float32)
+        kind = "lsa"
+    else:
+        size = 4 * matrix.shape[0] * matrix.shape[1]
+        if size > MAX_TFIDF_BYTES:
+            raise ValueError(
+                f"Dense TF-IDF vectors would take {size / 2**30:.1f} GB, build LSA vectors (dims > 0) instead"
+            )
+        vectors = matrix
+        kind = "tfidf"
+
+    write_index(index_dir, vectors, doc_ids, nlist, kind=kind, vocab_size=len(vocab))
+
+
+# Time exhaustive and IVF search on random unit vectors of increasing size
+def benchmark(
+    sizes: List[int], dim: int = 128, n_queries: int = 64, k: int = 10, nprobe: int = 8
+) -> List[Dict]:
+
+    rng = np.random.default_rng(0)
+    report = []
+
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            vectors = np.empty((n, dim), dtype=np.float32)
+            for start in range(0, n, 100000):
+                block = rng.standard_normal((min(100000, n - start), dim), dtype=np.float32)
+                vectors[start : start + len(block)] = l2_normalize(block)
+
+            nlist = max(1, int(math.sqrt(n)))
+            t0 = time.perf_counter()
+            write_index(tmp, vectors, np.arange(n), nlist=nlist)
+            build_s = time.perf_counter() - t0
+            del vectors
+
+            index = VectorIndex(tmp)
+            queries = np.asarray(index.vectors[rng.choice(n, n_queries, replace=False)])
+
+            t0 = time.perf_counter()
+            exact, _ = index.search(queries, k)
+            flat_ms = (time.perf_counter() - t0) * 1000 / n_queries
+
+            t0 = time.perf_counter()
+            approx, _ = index.search_ivf(queries, k, nprobe)
+            ivf_ms = (time.perf_counter() - t0) * 1000 / n_queries
+
+            recall = np.mean([len(set(a) & set(e)) / k for a, e in zip(approx, exact)])
+
+            row = dict(
+                n_docs=n, nlist=nlist, build_s=round(build_s, 3), flat_ms=round(flat_ms, 3),
+                ivf_ms=round(ivf_ms, 3), ivf_recall=round(float(recall), 3),
+            )
+            logger.info("%s", row)
+            report.append(row)
+            del index
+
+    return report
+
+
+if __name__ == "__main__":
+
+    assert len(sys.argv) > 2, (
+        "Not enough arguments: build <articles_dir> [index_dir] [dims] [nlist] | "
+        "similar <doc_id> [k] [nprobe] [index_dir] | bench <n1,n2,...>"
+    )
+
+    mode = sys.argv[1]
+
+    if mode == "build":
+        build_from_corpus(
+            sys.argv[2],
+            sys.argv[3] if len(sys.argv) > 3 else DEFAULT_INDEX_DIR,
+            dims=int(sys.argv[4]) if len(sys.argv) > 4 else 128,
+            nlist=int(sys.argv[5]) if len(sys.argv) > 5 else 0,
+        )
+    elif mode == "similar":
+        index = VectorIndex(sys.argv[5] if len(sys.argv) > 5 else DEFAULT_INDEX_DIR)
+        for doc_id, score in index.similar_to(
+            int(sys.argv[2]),
+            k=int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+            nprobe=int(sys.argv[4]) if len(sys.argv) > 4 else 0,
+        ):
+            print(f"{doc_id:>8} {score:.5f}")
+    elif mode == "bench":
+        benchmark([int(n) for n in sys.argv[2].split(",")])
+    else:
+        raise ValueError(f"Unknown mode {mode}")